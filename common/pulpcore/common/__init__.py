@@ -1 +1,2 @@
-from .constants import TASK_FINAL_STATES, TASK_INCOMPLETE_STATES, TASK_STATES, TASK_CHOICES  # noqa
+from .constants import (TASK_FINAL_STATES, TASK_INCOMPLETE_STATES, TASK_PRIORITIES,  # noqa
+                        TASK_PRIORITY_ORDER, TASK_STATES, TASK_CHOICES)
@@ -27,6 +27,16 @@ TASK_FINAL_STATES = (TASK_STATES.SKIPPED, TASK_STATES.COMPLETED, TASK_STATES.FAI
 #: Tasks in an incomplete state have not finished their work yet.
 TASK_INCOMPLETE_STATES = (TASK_STATES.WAITING, TASK_STATES.RUNNING)
 
+#: Task priorities. Tasks of a higher priority are dispatched, and performed by workers, first.
+TASK_PRIORITIES = SimpleNamespace(
+    HIGH='high',
+    DEFAULT='default',
+    LOW='low'
+)
+
+#: The task priorities, from the highest to the lowest.
+TASK_PRIORITY_ORDER = (TASK_PRIORITIES.HIGH, TASK_PRIORITIES.DEFAULT, TASK_PRIORITIES.LOW)
+
 SYNC_MODES = SimpleNamespace(
     ADDITIVE='additive',
     MIRROR='mirror'
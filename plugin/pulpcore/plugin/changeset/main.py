@@ -175,8 +175,7 @@ class ChangeSet:
                 with transaction.atomic():
                     for content in batch:
                         self._remove_content(content)
-                        bar.done += len(batch)
-                        bar.save()
+                        bar.increment()
                         report = ChangeReport(ChangeReport.REMOVED, content)
                         yield report
 
@@ -91,6 +91,12 @@ class DownloaderFactory:
 
         return aiohttp.ClientSession(connector=conn, **auth_options)
 
+    async def close(self):
+        """
+        Close the aiohttp session shared by the downloaders built by the factory.
+        """
+        await self._session.close()
+
     def build(self, url, **kwargs):
         """
         Build a downloader which can optionally verify integrity using either digest or size.
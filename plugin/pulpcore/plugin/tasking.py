@@ -2,10 +2,14 @@ from rq.job import get_current_job
 
 from pulpcore.app import models
 from pulpcore.exceptions import exception_to_dict
+from pulpcore.tasking.services import errors
 
 # Support plugins dispatching tasks
 from pulpcore.tasking.tasks import enqueue_with_reservation  # noqa
 
+# Support plugins dispatching tasks with a priority
+from pulpcore.common import TASK_PRIORITIES  # noqa
+
 # Support plugins working with the working directory.
 from pulpcore.tasking.services.storage import WorkingDirectory  # noqa
 
@@ -24,12 +28,13 @@ class Task:
 
     def append_non_fatal_error(self, error):
         """
-        Append and save a non-fatal error for the currently executing task.
+        Append a non-fatal error for the currently executing task.
         Fatal errors should not use this. Instead they should raise an Exception,
         preferably one that inherits from :class: `pulpcore.server.exception.PulpException`.
 
         This is saved in a structured way to the :attr: `~pulpcore.app.models.Task.non_fatal_errors`
-        attribute on the :class: `~pulpcore.app.models.Task` model.
+        of the :class: `~pulpcore.app.models.Task` model. Errors are buffered and saved in
+        batches, and the remaining ones are saved when the task ends.
 
         Args:
             error (Exception): The non fatal error to be appended.
@@ -38,7 +43,6 @@ class Task:
             pulpcore.app.models.Task.DoesNotExist: If not currently running inside a task.
 
         """
-        task = models.Task.objects.get(id=self.job.id)
-        serialized_error = exception_to_dict(error)
-        task.non_fatal_errors.append(serialized_error)
-        task.save()
+        if self.job is None:
+            raise models.Task.DoesNotExist()
+        errors.append_non_fatal_error(self.job.id, exception_to_dict(error))
@@ -6,15 +6,33 @@ import json
 from django.db import models
 
 
-class JSONField(models.TextField):
+class JSONField(models.Field):
     """
-    A custom Django field to serialize data into a text field and vice versa
+    A custom Django field to serialize data into a Postgres jsonb column and vice versa
 
+    The data is stored in its binary jsonb representation, which psycopg2 decodes when the column
+    is fetched, so deferring the field, e.g. with ``QuerySet.defer()``, skips both fetching and
+    decoding it.
     """
+    def db_type(self, connection):
+        """
+        Returns the database column data type
+
+        Args:
+            connection: The database connection
+
+        Returns:
+            str: The jsonb type
+        """
+        return 'jsonb'
+
     def from_db_value(self, value, *args, **kwargs):
         """
         Converts a value as returned by the database to a Python object
 
+        psycopg2 already decodes jsonb values, including JSON strings, so they are returned
+        unchanged.
+
         Args:
             value: DB value to convert to Python
             args: unused positional arguments
@@ -23,8 +41,6 @@ class JSONField(models.TextField):
         Returns:
             Python representation of ``value``
         """
-        if isinstance(value, str):
-            return self.to_python(value)
         return value
 
     def to_python(self, value):
@@ -16,7 +16,8 @@ from .repository import (  # noqa
     RepositoryVersion,
 )
 
-from .task import CreatedResource, ReservedResource, Task, TaskReservedResource, Worker  # noqa
+from .task import (CreatedResource, ReservedResource, Task, TaskNonFatalError,  # noqa
+                   TaskReservedResource, Worker)
 
 # Moved here to avoid a circular import with Task
 from .progress import ProgressBar, ProgressReport, ProgressSpinner  # noqa
@@ -4,18 +4,108 @@ Django models related to progress reporting
 from gettext import gettext as _
 import logging
 import datetime
+import time
 
 from django.db import models
 from django.utils import timezone
 
 from pulpcore.app.models import Model, Task
-from pulpcore.common import TASK_STATES, TASK_CHOICES
+from pulpcore.common import TASK_FINAL_STATES, TASK_STATES, TASK_CHOICES
+from pulpcore.tasking.connection import get_redis_connection
+from pulpcore.tasking.constants import TASKING_CONSTANTS
 
 _logger = logging.getLogger(__name__)
 
-# number of ms between save() calls when _using_context_manager is set
+# number of ms between save() calls when _using_context_manager is set, and between publications
+# of the done count of a progress report
 BATCH_INTERVAL = 500
 
+# The progress reports whose done count is not saved yet, by pk.
+_unsaved_done = {}
+
+# The field of the progress hash of a task counting its updates.
+_VERSION_FIELD = 'version'
+
+
+def save_unsaved_done():
+    """
+    Save the done count of all the progress reports which have progress not saved yet.
+
+    Called by the worker when a task ends, so the progress of the reports not saved again by the
+    task is not lost.
+    """
+    for report in list(_unsaved_done.values()):
+        report.save_done(force=True)
+
+
+def _publish(task_id, done):
+    """
+    Publish an update of the progress of a task.
+
+    The done counts of the progress reports of the task are stored in a Redis hash, along with the
+    number of updates, which is published on the progress channel of the task.
+
+    Args:
+        task_id (uuid.UUID): The id of the task.
+        done (dict): The done counts to store, by progress report pk.
+    """
+    redis_conn = get_redis_connection()
+    key = TASKING_CONSTANTS.PROGRESS_KEY.format(task_id=task_id)
+    pipe = redis_conn.pipeline()
+    pipe.hmset(key, done)
+    pipe.hincrby(key, _VERSION_FIELD, 1)
+    pipe.expire(key, TASKING_CONSTANTS.PROGRESS_TTL)
+    version = pipe.execute()[1]
+    redis_conn.publish(TASKING_CONSTANTS.PROGRESS_CHANNEL.format(task_id=task_id), version)
+
+
+def end_progress(task_id):
+    """
+    Forget the published progress of a task, once its progress reports and state are saved.
+
+    The end is published, so the clients waiting for an update load the saved progress.
+
+    Args:
+        task_id (uuid.UUID): The id of the task.
+    """
+    redis_conn = get_redis_connection()
+    redis_conn.delete(TASKING_CONSTANTS.PROGRESS_KEY.format(task_id=task_id))
+    redis_conn.publish(TASKING_CONSTANTS.PROGRESS_CHANNEL.format(task_id=task_id), 0)
+
+
+def wait_for_progress(task_id, version, timeout):
+    """
+    Wait for an update of the progress of a task.
+
+    Args:
+        task_id (uuid.UUID): The id of the task.
+        version (int): The number of updates of the progress already known, as returned by a
+            previous call. None when no update is known.
+        timeout (float): The maximum number of seconds to wait.
+
+    Returns:
+        int: The number of updates of the progress. It is returned right away when it differs from
+            ``version``, or when the task is finished. It starts from 0 again when the task ends.
+    """
+    redis_conn = get_redis_connection()
+    pubsub = redis_conn.pubsub(ignore_subscribe_messages=True)
+    pubsub.subscribe(TASKING_CONSTANTS.PROGRESS_CHANNEL.format(task_id=task_id))
+    try:
+        # subscribed first, so no update is missed
+        key = TASKING_CONSTANTS.PROGRESS_KEY.format(task_id=task_id)
+        current = int(redis_conn.hget(key, _VERSION_FIELD) or 0)
+        if current != version or \
+                Task.objects.filter(pk=task_id, state__in=TASK_FINAL_STATES).exists():
+            return current
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            message = pubsub.get_message(timeout=deadline - time.monotonic())
+            if message:
+                return int(message['data'])
+        return current
+    finally:
+        pubsub.close()
+
 
 class ProgressReport(Model):
     """
@@ -57,6 +147,7 @@ class ProgressReport(Model):
 
     _using_context_manager = False
     _last_save_time = None
+    _last_publish_time = None
 
     def save(self, *args, **kwargs):
         """
@@ -74,9 +165,56 @@ class ProgressReport(Model):
             if now - self._last_save_time >= datetime.timedelta(milliseconds=BATCH_INTERVAL):
                 super().save(*args, **kwargs)
                 self._last_save_time = now
+                _unsaved_done.pop(self.pk, None)
+                self._publish_done()
         else:
             super().save(*args, **kwargs)
             self._last_save_time = now
+            _unsaved_done.pop(self.pk, None)
+            self._publish_done()
+
+    def save_done(self, force=False):
+        """
+        Publish the done count, at most every BATCH_INTERVAL milliseconds.
+
+        The done count is published in Redis, see :func:`wait_for_progress`, and right away when
+        all the items are done. It is written to the database, along with the other fields, by
+        save(), when the context manager exits, or by the worker when the task ends.
+
+        Args:
+            force (bool): Write the done count to the database right away. Only the done count is
+                written, unless the progress report was never saved.
+        """
+        if self._state.adding:
+            self.save()
+            return
+        if force:
+            # the progress report is gone when its task was deleted meanwhile
+            ProgressReport.objects.filter(pk=self.pk).update(done=self.done)
+            _unsaved_done.pop(self.pk, None)
+            return
+        _unsaved_done[self.pk] = self
+        now = time.monotonic()
+        if self.done == self.total or self._last_publish_time is None or \
+                now - self._last_publish_time >= BATCH_INTERVAL / 1000:
+            self._publish_done()
+
+    def _publish_done(self):
+        """
+        Publish the done count in Redis, when the progress report belongs to a task.
+        """
+        if self.task_id:
+            _publish(self.task_id, {str(self.pk): self.done})
+        self._last_publish_time = time.monotonic()
+
+    def load_published_done(self):
+        """
+        Set the done count to the one published while the progress report runs.
+        """
+        key = TASKING_CONSTANTS.PROGRESS_KEY.format(task_id=self.task_id)
+        done = get_redis_connection().hget(key, str(self.pk))
+        if done is not None:
+            self.done = int(done)
 
     def __enter__(self):
         """
@@ -170,8 +308,10 @@ class ProgressBar(ProgressReport):
 
     The ProgressBar() is a context manager that provides automatic state transitions and saving for
     the RUNNING COMPLETED and FAILED states. The increment() method can be called in the loop as
-    work is completed. When ProgressBar() is used as a context manager progress reporting is rate
-    limited to every 500 milliseconds.
+    work is completed. increment() publishes the progress in Redis, at most every 500 milliseconds,
+    and progress reporting by save() is rate limited to every 500 milliseconds when ProgressBar()
+    is used as a context manager. The last progress is saved when the context manager exits, or
+    when the task ends.
     Use it as follows:
 
         >>> progress_bar = ProgressBar(message='Publishing files', total=len(files_iterator))
@@ -180,7 +320,7 @@ class ProgressBar(ProgressReport):
         >>>     # progress_bar saved as 'running'
         >>>     for file in files_iterator:
         >>>         handle(file)
-        >>>         progress_bar.increment()  # increments and saves
+        >>>         progress_bar.increment()  # increments and saves, at most every 500ms
         >>> # progress_bar is saved as 'completed' if no exception or 'failed' otherwise
 
     A convenience method called iter() allows you to avoid calling increment() directly:
@@ -211,15 +351,16 @@ class ProgressBar(ProgressReport):
 
     def increment(self):
         """
-        Increment done count and save the progress bar.
+        Increment done count and save it.
 
         This will increment and save the self.done attribute which is useful to put into a loop
-        processing items.
+        processing items. The writes are coalesced, see :meth:`save_done`, so incrementing costs
+        at most one write every 500 milliseconds.
         """
         self.done += 1
         if self.done > self.total:
             _logger.warning(_('Too many items processed for ProgressBar %s') % self.message)
-        self.save()
+        self.save_done()
 
     def iter(self, iter):
         """
@@ -1,10 +1,124 @@
-from django.db import models, transaction
+from gettext import gettext as _
+from logging import getLogger
+from threading import Lock, Thread
+import time
+
+from django.core.exceptions import ObjectDoesNotExist
+from django.db import connection, models, transaction
+from django.db.models.signals import pre_delete
+from django.dispatch import receiver
+from redis.exceptions import RedisError
+
+from pulpcore.tasking.connection import get_redis_connection
 
 from . import storage
 from .base import Model
+from .content import ContentArtifact
 from .task import CreatedResource
 
 
+log = getLogger(__name__)
+
+
+# The Redis key incremented each time distribution routing changes.
+ROUTING_GENERATION_KEY = 'pulp:distribution:routing'
+
+# The Redis channel the new routing generation is published to each time it changes.
+ROUTING_CHANNEL = 'pulp:distribution:routing:changes'
+
+# The number of seconds before subscribing again when the routing channel is disconnected.
+ROUTING_RESUBSCRIBE_INTERVAL = 1
+
+# The Redis hash mapping the relative paths of a publication to storage paths.
+PUBLICATION_INDEX_KEY = 'pulp:publication:{pk}:paths'
+
+# The field present in every publication index, which is not a relative path, so the index of a
+# publication without files exists too.
+PUBLICATION_INDEX_MARKER = '\0'
+
+# The Lua script setting the storage path of a relative path already in a publication index.
+PUBLICATION_INDEX_UPDATE_SCRIPT = """
+if redis.call('hexists', KEYS[1], ARGV[1]) == 1 then
+    return redis.call('hset', KEYS[1], ARGV[1], ARGV[2])
+end
+return 0
+"""
+
+# The number of paths written to the publication index in each round trip.
+PUBLICATION_INDEX_BATCH_SIZE = 1000
+
+# The number of published artifacts created by each bulk insert.
+PUBLISHED_ARTIFACT_BATCH_SIZE = 1000
+
+
+class PublicationManager(models.Manager):
+
+    def resolve(self, pk, relative_path):
+        """
+        Resolve the storage path of a published file using the publication index.
+
+        The index is shared by all processes, see :meth:`Publication.build_index`. No models are
+        instantiated and the database is not queried.
+
+        Args:
+            pk (UUID): The primary key of a complete publication.
+            relative_path (str): The relative path of the published file.
+
+        Returns:
+            str: The storage path of the published file. None when the index can not tell, either
+                because the publication has not been indexed or because the file is a published
+                artifact that is not stored.
+
+        Raises:
+            ObjectDoesNotExist: when the indexed publication does not contain the file.
+        """
+        key = PUBLICATION_INDEX_KEY.format(pk=pk)
+        pipe = get_redis_connection().pipeline(transaction=False)
+        storage_path, indexed = pipe.hget(key, relative_path).exists(key).execute()
+        if storage_path:
+            return storage_path.decode()
+        if indexed and storage_path is None:
+            raise ObjectDoesNotExist()
+
+    def drop_indexes(self, publications):
+        """
+        Drop the indexes of publications being deleted, once the transaction commits.
+
+        Called by every path deleting publications, including the deletion of their repository
+        version.
+
+        Args:
+            publications (django.db.models.QuerySet): The publications being deleted.
+        """
+        pks = publications.values_list('pk', flat=True)
+        keys = [PUBLICATION_INDEX_KEY.format(pk=pk) for pk in pks]
+        if keys:
+            transaction.on_commit(lambda: get_redis_connection().delete(*keys))
+
+    def index_artifact(self, content_artifact_pk, storage_path):
+        """
+        Index the storage path of an artifact stored after being published.
+
+        Artifacts of content added using a deferred download policy are indexed with an empty
+        storage path, until they are downloaded on demand. Only the paths already in an index are
+        updated, so an index being built or dropped is never partially recreated.
+
+        Args:
+            content_artifact_pk (uuid.UUID): The pk of the ContentArtifact of the stored artifact.
+            storage_path (str): The storage path of the stored artifact.
+        """
+        published = PublishedArtifact.objects.filter(
+            content_artifact=content_artifact_pk, publication__complete=True
+        ).values_list('publication_id', 'relative_path')
+        redis_conn = get_redis_connection()
+        update = redis_conn.register_script(PUBLICATION_INDEX_UPDATE_SCRIPT)
+        pipe = redis_conn.pipeline(transaction=False)
+        for pk, relative_path in published.iterator():
+            update(keys=[PUBLICATION_INDEX_KEY.format(pk=pk)], args=[relative_path, storage_path],
+                   client=pipe)
+        pipe.execute()
+
+
 class Publication(Model):
     """
     A publication contains metadata and artifacts associated with content
@@ -27,13 +141,10 @@ class Publication(Model):
         >>> repository_version = ...
         >>>
         >>> with Publication.create(repository_version, publisher) as publication:
-        >>>     for content in repository_version.content():
-        >>>         for content_artifact in content.contentartifact_set.all():
-        >>>             artifact = PublishedArtifact(...)
-        >>>             artifact.save()
-        >>>             metadata = PublishedMetadata(...)
-        >>>             metadata.save()
-        >>>             ...
+        >>>     publication.publish_artifacts()
+        >>>     metadata = PublishedMetadata(...)
+        >>>     metadata.save()
+        >>>     ...
         >>>
     """
 
@@ -42,6 +153,8 @@ class Publication(Model):
     publisher = models.ForeignKey('Publisher', on_delete=models.CASCADE)
     repository_version = models.ForeignKey('RepositoryVersion', on_delete=models.CASCADE)
 
+    objects = PublicationManager()
+
     @classmethod
     def create(cls, repository_version, publisher):
         """
@@ -93,8 +206,155 @@ class Publication(Model):
         """
         with transaction.atomic():
             CreatedResource.objects.filter(object_id=self.pk).delete()
+            Publication.objects.drop_indexes(Publication.objects.filter(pk=self.pk))
             super().delete(**kwargs)
 
+    def previous(self):
+        """
+        Get the previous complete publication of the repository by the same publisher.
+
+        Returns:
+            pulpcore.app.models.Publication: The publication of the latest repository version
+                preceding the published one. None when there is no such publication.
+        """
+        return Publication.objects.filter(
+            complete=True,
+            publisher=self.publisher_id,
+            repository_version__repository=self.repository_version.repository_id,
+            repository_version__number__lt=self.repository_version.number
+        ).order_by('-repository_version__number', '-created').first()
+
+    def publish_artifacts(self, relative_path=None, incremental=False):
+        """
+        Publish all the content artifacts of the repository version.
+
+        The content artifacts are streamed by a single query using a server-side cursor, and the
+        published artifacts are created by batches of bulk inserts. Progress is reported using a
+        ProgressBar, so this is expected to be called by a task.
+
+        When incremental, the published artifacts of the previous publication are copied by a
+        single INSERT ... SELECT, except those of content removed since, and counted as done in
+        the progress. Only the content artifacts of content added since are then published.
+        Publishers can use :meth:`previous` with :meth:`RepositoryVersion.added_since` and
+        :meth:`RepositoryVersion.removed_since` to only update the affected metadata.
+
+        Args:
+            relative_path (callable): Get the relative path of a ContentArtifact within the
+                publication. Defaults to the relative path of the content artifact. It must be the
+                same as for the previous publication when incremental.
+            incremental (bool): Derive the publication from the previous publication, if any.
+
+        Returns:
+            int: The number of published artifacts.
+        """
+        # Imported here to avoid a circular import with Task.
+        from .progress import ProgressBar
+
+        previous = self.previous() if incremental else None
+        if previous:
+            version = self.repository_version
+            copied = self._copy_published_artifacts(
+                previous, version.removed_since(previous.repository_version))
+            content = version.added_since(previous.repository_version)
+        else:
+            copied = 0
+            content = self.repository_version.content
+
+        content_artifacts = ContentArtifact.objects.filter(content__in=content)
+        total = copied + content_artifacts.count()
+        with ProgressBar(message=_('Publishing Artifacts'), total=total, done=copied) as bar:
+            batch = []
+            for content_artifact in content_artifacts.iterator():
+                if relative_path:
+                    path = relative_path(content_artifact)
+                else:
+                    path = content_artifact.relative_path
+                batch.append(PublishedArtifact(publication=self, relative_path=path,
+                                               content_artifact=content_artifact))
+                if len(batch) >= PUBLISHED_ARTIFACT_BATCH_SIZE:
+                    PublishedArtifact.objects.bulk_create(batch)
+                    bar.done += len(batch)
+                    bar.save_done()
+                    batch = []
+            if batch:
+                PublishedArtifact.objects.bulk_create(batch)
+                bar.done += len(batch)
+        return total
+
+    def _copy_published_artifacts(self, publication, excluded):
+        """
+        Copy the published artifacts of another publication into this one.
+
+        The ids of the copies are random (version 4) UUIDs made by the database, from the md5 of
+        the copied row id, this publication id and random data, so no extension is required.
+
+        Args:
+            publication (pulpcore.app.models.Publication): The publication copied from.
+            excluded (django.db.models.QuerySet): Content which published artifacts are not
+                copied.
+
+        Returns:
+            int: The number of published artifacts copied.
+        """
+        excluded_sql, excluded_params = excluded.values('pk').query.sql_with_params()
+        sql = (
+            'INSERT INTO {published} (id, created, last_updated, relative_path, publication_id, '
+            'content_artifact_id) '
+            'SELECT overlay(overlay(md5(p.id::text || %s::text || random()::text || '
+            'clock_timestamp()::text) placing \'4\' from 13) '
+            'placing to_hex(8 + floor(random() * 4)::int) from 17)::uuid, now(), now(), '
+            'p.relative_path, %s, p.content_artifact_id '
+            'FROM {published} p INNER JOIN {content_artifact} c ON p.content_artifact_id = c.id '
+            'WHERE p.publication_id = %s AND c.content_id NOT IN ({excluded})'
+        ).format(
+            published=PublishedArtifact._meta.db_table,
+            content_artifact=ContentArtifact._meta.db_table,
+            excluded=excluded_sql)
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [self.pk, self.pk, publication.pk, *excluded_params])
+            return cursor.rowcount
+
+    def build_index(self):
+        """
+        Build the index of relative paths to storage paths for this publication.
+
+        The index is a Redis hash shared between all content serving processes. It is written
+        under a temporary key and renamed when complete so a partial index is never used.
+        Published artifacts that are not stored are indexed with an empty storage path. The index
+        of a publication without files only holds the PUBLICATION_INDEX_MARKER field.
+        """
+        key = PUBLICATION_INDEX_KEY.format(pk=self.pk)
+        building = '{key}:building'.format(key=key)
+        redis_conn = get_redis_connection()
+        redis_conn.delete(building)
+
+        # Artifacts are written last, so they take precedence on conflicting paths.
+        metadata = self.published_metadata.values_list('relative_path', 'file')
+        artifacts = self.published_artifact.values_list('relative_path',
+                                                        'content_artifact__artifact__file')
+        batch = {PUBLICATION_INDEX_MARKER: ''}
+        for query in (metadata, artifacts):
+            for relative_path, storage_path in query.iterator():
+                batch[relative_path] = storage_path or ''
+                if len(batch) >= PUBLICATION_INDEX_BATCH_SIZE:
+                    redis_conn.hmset(building, batch)
+                    batch = {}
+        if batch:
+            redis_conn.hmset(building, batch)
+        redis_conn.rename(building, key)
+
+    def _index(self):
+        """
+        Build the index once the publication is committed.
+
+        A failure must not skip the callbacks registered after it, which distribute the
+        publication. Content servers fall back to the database for a publication not indexed.
+        """
+        try:
+            self.build_index()
+        except RedisError:
+            log.exception(_('Indexing of publication %(pk)s failed'), {'pk': self.pk})
+
     def __enter__(self):
         return self
 
@@ -104,12 +364,14 @@ class Publication(Model):
                 self.complete = True
                 self.save()
 
+                # Index before distributing so content servers find the index.
+                transaction.on_commit(self._index)
+
                 # Auto-Distribution
-                distributions = Distribution.objects.filter(publisher=self.publisher,
-                                                            repository=self.repository)
-                for distribution in distributions:
-                    distribution.publication = self
-                    distribution.save()
+                Distribution.objects.filter(
+                    publisher=self.publisher_id,
+                    repository=self.repository_version.repository_id
+                ).update(publication=self)
         else:
             self.delete()
 
@@ -171,6 +433,182 @@ class PublishedMetadata(PublishedFile):
         )
 
 
+class DistributionQuerySet(models.QuerySet):
+
+    def update(self, **kwargs):
+        """
+        Update the distributions and invalidate the content routing.
+
+        Args:
+            kwargs (dict): The fields to update.
+
+        Returns:
+            int: The number of distributions updated.
+        """
+        updated = super().update(**kwargs)
+        if updated:
+            Distribution.objects.invalidate_routes()
+        return updated
+
+    def delete(self):
+        """
+        Delete the distributions and invalidate the content routing.
+
+        Returns:
+            tuple: The number of objects deleted and the number by model.
+        """
+        deleted = super().delete()
+        if deleted[0]:
+            Distribution.objects.invalidate_routes()
+        return deleted
+
+
+class DistributionManager(models.Manager.from_queryset(DistributionQuerySet)):
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._lock = Lock()
+        self._routes = None
+        self._generation = None
+        self._subscriber = None
+        # The latest generation published while subscribed, or None when not subscribed.
+        self._published = None
+
+    def _get_routes(self):
+        """
+        Get the in-process routing tree, rebuilding it when distributions have changed.
+
+        Every process keeps its own copy of the tree. Processes learn about changes made anywhere
+        through a generation counter stored in Redis, see :meth:`invalidate_routes`. The counter
+        is read for each lookup unless the process has subscribed to changes.
+
+        Returns:
+            dict: A tree of base path segments. A node matching a base path has the
+                matched :class:`~pulpcore.app.models.Distribution` stored under the `None` key.
+        """
+        generation = self._published
+        if generation is None:
+            generation = get_redis_connection().get(ROUTING_GENERATION_KEY)
+        with self._lock:
+            if self._routes is None or generation != self._generation:
+                routes = {}
+                fields = ('pk', 'name', 'base_path', 'publication_id')
+                for values in self.values_list(*fields).iterator():
+                    distribution = self.model(**dict(zip(fields, values)))
+                    node = routes
+                    for segment in distribution.base_path.split('/'):
+                        node = node.setdefault(segment, {})
+                    node[None] = distribution
+                self._routes = routes
+                self._generation = generation
+            return self._routes
+
+    def match(self, path):
+        """
+        Match the distribution serving a path.
+
+        The lookup is made against an in-process tree of base paths, so the database is only
+        queried after distributions have changed.
+
+        Args:
+            path (str): A path, relative to the content app, of a file being served.
+
+        Returns:
+            pulpcore.app.models.Distribution: The matched distribution. It only has the `name`,
+                `base_path` and `publication_id` fields loaded.
+
+        Raises:
+            Distribution.DoesNotExist: when not matched.
+        """
+        node = self._get_routes()
+        for segment in path.strip('/').split('/')[:-1]:
+            try:
+                node = node[segment]
+            except KeyError:
+                break
+            if None in node:
+                return node[None]
+        raise self.model.DoesNotExist()
+
+    def overlapping(self, base_path, exclude=None):
+        """
+        Find a distribution which base path overlaps with a base path.
+
+        Base paths overlap when they are equal, or when one is nested in the other. The lookup is
+        made against the in-process tree of base paths used by :meth:`match`.
+
+        Args:
+            base_path (str): A base path.
+            exclude (UUID): The primary key of a distribution to ignore.
+
+        Returns:
+            pulpcore.app.models.Distribution: An overlapping distribution, None when there is
+                none. It only has the `name`, `base_path` and `publication_id` fields loaded.
+        """
+        node = self._get_routes()
+        # base paths nesting (or equal to) base_path
+        for segment in base_path.split('/'):
+            try:
+                node = node[segment]
+            except KeyError:
+                return None
+            distribution = node.get(None)
+            if distribution is not None and distribution.pk != exclude:
+                return distribution
+        # base paths nested in base_path
+        nodes = [child for key, child in node.items() if key is not None]
+        while nodes:
+            node = nodes.pop()
+            distribution = node.get(None)
+            if distribution is not None and distribution.pk != exclude:
+                return distribution
+            nodes.extend(child for key, child in node.items() if key is not None)
+
+    def invalidate_routes(self):
+        """
+        Notify all processes that the routing of distributions has changed.
+
+        The notification is sent once the current transaction is committed. The new generation is
+        also published to the ROUTING_CHANNEL for processes that have subscribed to changes.
+        """
+        def notify():
+            redis_conn = get_redis_connection()
+            redis_conn.publish(ROUTING_CHANNEL, redis_conn.incr(ROUTING_GENERATION_KEY))
+
+        transaction.on_commit(notify)
+
+    def subscribe(self):
+        """
+        Subscribe to changes of the routing of distributions.
+
+        Changes are then received by a background thread, so matching a path no longer reads the
+        generation counter from Redis. Meant for long running content serving processes.
+        """
+        with self._lock:
+            if self._subscriber is None:
+                self._subscriber = Thread(target=self._listen, daemon=True)
+                self._subscriber.start()
+
+    def _listen(self):
+        """
+        Receive the generations published to the ROUTING_CHANNEL, forever.
+
+        The generation counter is read once subscribed, so no change is missed. While
+        disconnected, the counter is read for each lookup again.
+        """
+        while True:
+            try:
+                pubsub = get_redis_connection().pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(ROUTING_CHANNEL)
+                self._published = get_redis_connection().get(ROUTING_GENERATION_KEY) or b''
+                for message in pubsub.listen():
+                    self._published = message['data']
+            except RedisError:
+                log.exception(_('Subscription to distribution changes lost'))
+            self._published = None
+            time.sleep(ROUTING_RESUBSCRIBE_INTERVAL)
+
+
 class Distribution(Model):
     """
     A distribution defines how a publication is distributed by pulp.
@@ -197,5 +635,41 @@ class Distribution(Model):
     publisher = models.ForeignKey('Publisher', null=True, on_delete=models.SET_NULL)
     repository = models.ForeignKey('Repository', null=True, on_delete=models.SET_NULL)
 
+    objects = DistributionManager()
+
     class Meta:
         default_related_name = 'distributions'
+
+    def save(self, *args, **kwargs):
+        """
+        Save the distribution and invalidate the content routing.
+
+        Args:
+            args (list): list of positional arguments for Model.save()
+            kwargs (dict): dictionary of keyword arguments to pass to Model.save()
+        """
+        super().save(*args, **kwargs)
+        Distribution.objects.invalidate_routes()
+
+    def delete(self, *args, **kwargs):
+        """
+        Delete the distribution and invalidate the content routing.
+
+        Args:
+            args (list): list of positional arguments for Model.delete()
+            kwargs (dict): dictionary of keyword arguments to pass to Model.delete()
+        """
+        super().delete(*args, **kwargs)
+        Distribution.objects.invalidate_routes()
+
+
+@receiver(pre_delete, sender=Publication)
+def _publication_deleted(sender, instance, **kwargs):
+    """
+    Invalidate the content routing when a distributed publication is deleted.
+
+    Distributions are unset by the database cascade, without Distribution.save(), whether the
+    publication itself is deleted or its repository version, repository or publisher.
+    """
+    if Distribution.objects.filter(publication=instance).exists():
+        Distribution.objects.invalidate_routes()
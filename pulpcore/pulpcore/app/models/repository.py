@@ -3,11 +3,13 @@ Repository related Django models.
 """
 from contextlib import suppress
 from django.db import models
+from django.db.models import OuterRef, Subquery
 from django.db import transaction
 
 from .base import Model, MasterModel
 from .content import Content
 from .generic import Notes, GenericKeyValueRelation
+from .publication import Publication
 from .task import CreatedResource
 
 from pulpcore.app.models.storage import get_tls_path
@@ -127,6 +129,17 @@ class Publisher(MasterModel):
     class Meta:
         default_related_name = 'publishers'
 
+    def delete(self, **kwargs):
+        """
+        Delete the publisher, along with its publications.
+
+        Args:
+            **kwargs (dict): Delete options.
+        """
+        with transaction.atomic():
+            Publication.objects.drop_indexes(Publication.objects.filter(publisher=self))
+            super().delete(**kwargs)
+
 
 class Exporter(MasterModel):
     """
@@ -318,6 +331,40 @@ class RepositoryVersion(Model):
         """
         return Content.objects.filter(version_memberships__version_removed=self)
 
+    def added_since(self, base):
+        """
+        Args:
+            base (pulpcore.app.models.RepositoryVersion): A previous version of the same
+                repository.
+
+        Returns:
+            QuerySet: The Content objects contained in this version but not in the base version,
+                including content removed and then added again since the base version.
+        """
+        relationships = RepositoryContent.objects.filter(
+            repository=self.repository,
+            version_added__number__gt=base.number,
+            version_added__number__lte=self.number
+        ).exclude(version_removed__number__lte=self.number)
+        return Content.objects.filter(version_memberships__in=relationships)
+
+    def removed_since(self, base):
+        """
+        Args:
+            base (pulpcore.app.models.RepositoryVersion): A previous version of the same
+                repository.
+
+        Returns:
+            QuerySet: The Content objects contained in the base version but not in this version,
+                including content removed and then added again since the base version.
+        """
+        relationships = RepositoryContent.objects.filter(
+            repository=self.repository,
+            version_added__number__lte=base.number,
+            version_removed__number__gt=base.number,
+            version_removed__number__lte=self.number)
+        return Content.objects.filter(version_memberships__in=relationships)
+
     def next(self):
         """
         Returns:
@@ -389,27 +436,57 @@ class RepositoryVersion(Model):
         repo_relations.filter(version_added=self, version_removed=next_version).delete()
 
         # If the same content is deleted in version, but added back in next_version
-        # set version_removed field in relation to None, and remove relation adding the content
-        # in next_version
-        content_added = repo_relations.filter(version_added=next_version).values_list('content_id')
-
-        # use list() to force the evaluation of the queryset, otherwise queryset is affected
-        # by the update() operation before delete() is ran
-        content_removed_and_readded = list(repo_relations.filter(version_removed=self,
-                                                                 content_id__in=content_added)
-                                           .values_list('content_id'))
-
-        repo_relations.filter(version_removed=self,
-                              content_id__in=content_removed_and_readded)\
-            .update(version_removed=None)
-
-        repo_relations.filter(version_added=next_version,
-                              content_id__in=content_removed_and_readded).delete()
+        # set version_removed field in relation to the version removing the content added in
+        # next_version, if any, and remove relation adding the content in next_version
+        content_added = repo_relations.filter(version_added=next_version).values('content_id')
+        next_removal = repo_relations.filter(version_added=next_version,
+                                             content_id=OuterRef('content_id'))
+        repo_relations.filter(version_removed=self, content_id__in=content_added)\
+            .update(version_removed=Subquery(next_removal.values('version_removed')[:1]))
+
+        # content added up to this version and not removed up to it, which is also added in
+        # next_version, was re-added by the update above, so those are the relations added in
+        # next_version to be dropped.
+        content_readded = repo_relations.filter(version_added__number__lte=self.number,
+                                                content_id__in=content_added)\
+            .exclude(version_removed__number__lte=self.number).values('content_id')
+        repo_relations.filter(version_added=next_version, content_id__in=content_readded).delete()
 
         # "squash" by moving other additions and removals forward to the next version
         repo_relations.filter(version_added=self).update(version_added=next_version)
         repo_relations.filter(version_removed=self).update(version_removed=next_version)
 
+    def squash_previous(self):
+        """
+        Squash all complete versions older than this one into this version and delete them.
+
+        This is equivalent to deleting each older version in turn, but it only makes a single pass
+        over the repository content relations regardless of how many versions are squashed.
+
+        Should be done in a RQ Job.
+
+        Returns:
+            int: The number of versions deleted.
+
+        Raise:
+            pulpcore.exception.ResourceImmutableError: if squash_previous is called on an
+                incomplete RepositoryVersion
+        """
+        if not self.complete:
+            raise ResourceImmutableError(self)
+
+        versions = self.repository.versions.filter(number__lt=self.number, complete=True)
+        repo_relations = RepositoryContent.objects.filter(repository=self.repository,
+                                                          version_added__in=versions)
+
+        with transaction.atomic():
+            # content added and removed again by this version is not part of any kept version.
+            repo_relations.filter(version_removed__number__lte=self.number).delete()
+            repo_relations.update(version_added=self)
+            Publication.objects.drop_indexes(
+                Publication.objects.filter(repository_version__in=versions))
+            return versions.delete()[1].get(RepositoryVersion._meta.label, 0)
+
     def delete(self, **kwargs):
         """
         Deletes a RepositoryVersion
@@ -431,6 +508,7 @@ class RepositoryVersion(Model):
                 # and delete the version
                 repo_relations.filter(version_added=self).delete()
                 repo_relations.filter(version_removed=self).update(version_removed=None)
+            Publication.objects.drop_indexes(Publication.objects.filter(repository_version=self))
             super().delete(**kwargs)
 
         else:
@@ -1,20 +1,29 @@
 """
 Django models related to the Tasking system
 """
-from datetime import timedelta
+from datetime import datetime
 from gettext import gettext as _
 import logging
+import random
+import time
 import traceback
+import uuid
 
-from django.db import models, transaction
+from django.conf import settings
+from django.db import connection, models, transaction
 from django.utils import timezone
-from rq.job import get_current_job
+from rq import Queue
+from rq.job import Job, get_current_job
+from rq.registry import StartedJobRegistry
+from rq.utils import current_timestamp, utcnow, utcparse
 
 from pulpcore.app.models import Model, GenericRelationModel
 from pulpcore.app.fields import JSONField
 from pulpcore.common import TASK_FINAL_STATES, TASK_CHOICES, TASK_STATES
 from pulpcore.exceptions import exception_to_dict
+from pulpcore.tasking.connection import get_redis_connection
 from pulpcore.tasking.constants import TASKING_CONSTANTS
+from pulpcore.tasking.queues import queue_names
 
 
 _logger = logging.getLogger(__name__)
@@ -63,18 +72,19 @@ class WorkerManager(models.Manager):
 
     def get_unreserved_worker(self):
         """
-        Randomly selects an unreserved :class:`~pulpcore.app.models.Worker`
+        Selects the least loaded unreserved :class:`~pulpcore.app.models.Worker`
 
-        Return a random Worker instance that has no :class:`~pulpcore.app.models.ReservedResource`
-        associated with it. If all workers have at least one ReservedResource relationship, a
+        Return the Worker instance that has no :class:`~pulpcore.app.models.ReservedResource`
+        associated with it, and the least load relative to its capacity. Workers without capacity
+        are not selected. If all workers have at least one ReservedResource relationship, a
         :class:`pulpcore.app.models.Worker.DoesNotExist` exception is raised.
 
         This method filters out resource managers which do not process end-user Tasks.
 
-        This method provides randomization for Worker selection to distribute load across workers.
+        Equally loaded workers are selected randomly to distribute load across workers.
 
         Returns:
-            :class:`pulpcore.app.models.Worker`: A randomly-selected Worker instance that has zero
+            :class:`pulpcore.app.models.Worker`: The least loaded Worker instance that has zero
                 :class:`~pulpcore.app.models.ReservedResource` entries associated with it.
 
         Raises:
@@ -82,10 +92,118 @@ class WorkerManager(models.Manager):
         """
         workers_qs = self.online_workers().filter(name__startswith=TASKING_CONSTANTS.WORKER_PREFIX)
         workers_qs_with_counts = workers_qs.annotate(models.Count('reservations'))
-        try:
-            return workers_qs_with_counts.filter(reservations__count=0).order_by('?')[0]
-        except IndexError:
+        workers = [worker for worker in workers_qs_with_counts.filter(reservations__count=0)
+                   if worker.capacity > 0]
+        if not workers:
             raise self.model.DoesNotExist()
+        random.shuffle(workers)
+        loads = self.loads(workers)
+        return min(workers, key=lambda worker: loads[worker.name] / worker.capacity)
+
+    def loads(self, workers):
+        """
+        Get the loads of workers, as defined by :meth:`Worker.load`.
+
+        The queues and the started job registries of all the workers are read by a first pipeline,
+        and the start times of the running jobs by a second one.
+
+        Args:
+            workers (list): The :class:`~pulpcore.app.models.Worker` instances.
+
+        Returns:
+            dict: The load of each worker, by worker name.
+        """
+        redis_conn = get_redis_connection()
+        queues = [(worker.name, name) for worker in workers for name in queue_names(worker.name)]
+        pipe = redis_conn.pipeline(transaction=False)
+        for _worker, name in queues:
+            pipe.llen(Queue(name, connection=redis_conn).key)
+            # expired jobs are left to the cleanup of the registry
+            registry = StartedJobRegistry(name, connection=redis_conn)
+            pipe.zrangebyscore(registry.key, '({}'.format(current_timestamp()), '+inf')
+        replies = iter(pipe.execute())
+
+        loads = {worker.name: 0 for worker in workers}
+        running = []
+        for worker_name, _name in queues:
+            loads[worker_name] += next(replies)
+            job_ids = next(replies)
+            loads[worker_name] += len(job_ids)
+            for job_id in job_ids:
+                pipe.hget(Job.key_for(job_id.decode()), 'started_at')
+                running.append(worker_name)
+        if running:
+            for worker_name, started_at in zip(running, pipe.execute()):
+                if started_at:
+                    age = (utcnow() - utcparse(started_at.decode())).total_seconds()
+                    loads[worker_name] += age / TASKING_CONSTANTS.RUNNING_JOB_LOAD_INTERVAL
+        return loads
+
+    def heartbeat(self, name):
+        """
+        Record a heartbeat of a worker.
+
+        Heartbeats are recorded in Redis, and saved to the last_heartbeat fields in batches by
+        :meth:`save_heartbeats`, so a heartbeat does not write to the database.
+
+        Args:
+            name (str): The name of the worker.
+
+        Returns:
+            bool: True when the worker had no heartbeat recorded, i.e. when it starts, or when it
+                was marked offline.
+        """
+        redis_conn = get_redis_connection()
+        return bool(redis_conn.execute_command(
+            'ZADD', TASKING_CONSTANTS.HEARTBEATS_KEY, time.time(), name))
+
+    def forget_heartbeat(self, name):
+        """
+        Forget the heartbeats of a worker marked offline.
+
+        Args:
+            name (str): The name of the worker.
+        """
+        get_redis_connection().zrem(TASKING_CONSTANTS.HEARTBEATS_KEY, name)
+
+    def heartbeats(self):
+        """
+        Get the time of the last heartbeat of each worker.
+
+        Returns:
+            dict: The time of the last heartbeat (datetime.datetime) by worker name.
+        """
+        redis_conn = get_redis_connection()
+        heartbeats = redis_conn.zrange(TASKING_CONSTANTS.HEARTBEATS_KEY, 0, -1, withscores=True)
+        return {name.decode(): datetime.fromtimestamp(score, timezone.utc)
+                for name, score in heartbeats}
+
+    def save_heartbeats(self, heartbeats):
+        """
+        Save the time of the last heartbeat of workers with a single query.
+
+        Args:
+            heartbeats (dict): The time of the last heartbeat by worker name.
+        """
+        if not heartbeats:
+            return
+        last_heartbeat = models.Case(
+            *(models.When(name=name, then=models.Value(heartbeat))
+              for name, heartbeat in heartbeats.items()),
+            output_field=models.DateTimeField())
+        self.filter(name__in=heartbeats).update(last_heartbeat=last_heartbeat)
+
+    def _recent_heartbeats(self):
+        """
+        Get the names of workers with a heartbeat within the pulp process timeout interval.
+
+        Returns:
+            list: The names of the workers.
+        """
+        redis_conn = get_redis_connection()
+        age_threshold = time.time() - TASKING_CONSTANTS.WORKER_TTL
+        names = redis_conn.zrangebyscore(TASKING_CONSTANTS.HEARTBEATS_KEY, age_threshold, '+inf')
+        return [name.decode() for name in names]
 
     def online_workers(self):
         """
@@ -99,10 +217,7 @@ class WorkerManager(models.Manager):
             :class:`django.db.models.query.QuerySet`:  A query set of the Worker objects which
                 are considered by Pulp to be 'online'.
         """
-        now = timezone.now()
-        age_threshold = now - timedelta(seconds=TASKING_CONSTANTS.WORKER_TTL)
-
-        return self.filter(last_heartbeat__gte=age_threshold, gracefully_stopped=False)
+        return self.filter(name__in=self._recent_heartbeats(), gracefully_stopped=False)
 
     def missing_workers(self):
         """
@@ -116,10 +231,7 @@ class WorkerManager(models.Manager):
             :class:`django.db.models.query.QuerySet`:  A query set of the Worker objects which
                 are considered by Pulp to be 'missing'.
         """
-        now = timezone.now()
-        age_threshold = now - timedelta(seconds=TASKING_CONSTANTS.WORKER_TTL)
-
-        return self.filter(last_heartbeat__lt=age_threshold, gracefully_stopped=False)
+        return self.filter(gracefully_stopped=False).exclude(name__in=self._recent_heartbeats())
 
     def dirty_workers(self):
         """
@@ -136,11 +248,7 @@ class WorkerManager(models.Manager):
             :class:`django.db.models.query.QuerySet`:  A query set of the Worker objects which
                 are considered by Pulp to be 'dirty'.
         """
-        now = timezone.now()
-        age_threshold = now - timedelta(seconds=TASKING_CONSTANTS.WORKER_TTL)
-
-        return self.filter(last_heartbeat__lt=age_threshold,
-                           cleaned_up=False, gracefully_stopped=False)
+        return self.missing_workers().filter(cleaned_up=False)
 
     def with_reservations(self, resources):
         """
@@ -169,7 +277,8 @@ class Worker(Model):
     Fields:
 
         name (models.TextField): The name of the worker, in the format "worker_type@hostname"
-        last_heartbeat (models.DateTimeField): A timestamp of this worker's last heartbeat
+        last_heartbeat (models.DateTimeField): A timestamp of this worker's last heartbeat, saved
+            periodically from the heartbeats recorded in Redis
         gracefully_stopped (models.BooleanField): True if the worker has gracefully stopped. Default
             is False.
         cleaned_up (models.BooleanField): True if the worker has been cleaned up. Default is False.
@@ -193,10 +302,7 @@ class Worker(Model):
         Returns:
             bool: True if the worker is considered online, otherwise False
         """
-        now = timezone.now()
-        age_threshold = now - timedelta(seconds=TASKING_CONSTANTS.WORKER_TTL)
-
-        return not self.gracefully_stopped and self.last_heartbeat >= age_threshold
+        return not self.gracefully_stopped and self._heartbeat_is_recent()
 
     @property
     def missing(self):
@@ -210,41 +316,80 @@ class Worker(Model):
         Returns:
             bool: True if the worker is considered missing, otherwise False
         """
-        now = timezone.now()
-        age_threshold = now - timedelta(seconds=TASKING_CONSTANTS.WORKER_TTL)
+        return not self.gracefully_stopped and not self._heartbeat_is_recent()
 
-        return not self.gracefully_stopped and self.last_heartbeat < age_threshold
+    def _heartbeat_is_recent(self):
+        """
+        Returns:
+            bool: True if the last heartbeat is within the pulp process timeout interval.
+        """
+        redis_conn = get_redis_connection()
+        heartbeat = redis_conn.zscore(TASKING_CONSTANTS.HEARTBEATS_KEY, self.name)
+        return heartbeat is not None and heartbeat >= time.time() - TASKING_CONSTANTS.WORKER_TTL
 
-    def save_heartbeat(self):
+    @property
+    def capacity(self):
         """
-        Update the last_heartbeat field to now and save it.
+        The capacity of the worker relative to other workers.
 
-        Only the last_heartbeat field will be saved. No other changes will be saved.
+        Configured by worker name, or by worker name without the host, in the
+        ``TASKING['WORKER_CAPACITY']`` setting. Defaults to 1. Workers with a capacity of 0 are
+        not dispatched tasks to.
 
-        Raises:
-            ValueError: When the model instance has never been saved before. This method can
-                only update an existing database record.
+        Returns:
+            float: The capacity of the worker.
+        """
+        capacities = settings.TASKING['WORKER_CAPACITY']
+        return capacities.get(self.name, capacities.get(self.name.split('@')[0], 1))
+
+    def load(self):
         """
-        self.save(update_fields=['last_heartbeat'])
+        Get the number of jobs queued for, or running on, the worker, of all priorities.
+
+        A running job counts as one more job for each RUNNING_JOB_LOAD_INTERVAL it has run, so
+        workers running long tasks, such as syncs, are considered more loaded.
+
+        Returns:
+            float: The load of the worker.
+        """
+        return Worker.objects.loads([self])[self.name]
 
     def lock_resources(self, task, resource_urls):
         """
-        Attempt to lock all resources by their urls. Must be atomic to prevent deadlocks.
+        Atomically reserve resources by their urls for a task on this worker.
+
+        Each reservation is created, or locked when it exists, by a single upsert. The resources
+        are reserved in a consistent order, which prevents deadlocks between concurrent
+        dispatchers, and locked reservations can't be released until the transaction ends.
 
         Arguments:
             task (pulpcore.app.models.Task): task to lock the resource for
             resource_urls (List): a list of resource urls to be locked
 
-        Raises:
-            django.db.IntegrityError: If the reservation already exists
+        Returns:
+            bool: True when the resources are reserved. False when any of them is reserved by
+                another worker, in which case none is reserved.
         """
+        sql = (
+            'INSERT INTO {table} (id, created, last_updated, resource, worker_id) '
+            'VALUES (%s, now(), now(), %s, %s) '
+            'ON CONFLICT (resource) DO UPDATE SET last_updated = now() '
+            'RETURNING id, worker_id'
+        ).format(table=ReservedResource._meta.db_table)
         with transaction.atomic():
-            for resource in resource_urls:
-                if self.reservations.filter(resource=resource).exists():
-                    reservation = self.reservations.get(resource=resource)
-                else:
-                    reservation = ReservedResource.objects.create(worker=self, resource=resource)
-                TaskReservedResource.objects.create(resource=reservation, task=task)
+            reservations = []
+            with connection.cursor() as cursor:
+                for resource in sorted(set(resource_urls)):
+                    cursor.execute(sql, [uuid.uuid4(), resource, self.pk])
+                    reservation_id, worker_id = cursor.fetchone()
+                    if worker_id != self.pk:
+                        transaction.set_rollback(True)
+                        return False
+                    reservations.append(reservation_id)
+            TaskReservedResource.objects.bulk_create(
+                TaskReservedResource(resource_id=reservation_id, task=task)
+                for reservation_id in reservations)
+        return True
 
 
 class Task(Model):
@@ -256,8 +401,8 @@ class Task(Model):
         state (models.TextField): The state of the task
         started_at (models.DateTimeField): The time the task started executing
         finished_at (models.DateTimeField): The time the task finished executing
-        non_fatal_errors (pulpcore.app.fields.JSONField): Dictionary of non-fatal errors that
-            occurred while task was running.
+        non_fatal_errors_overflow (models.PositiveIntegerField): The number of non-fatal errors
+            which were not recorded because the task had too many.
         error (pulpcore.app.fields.JSONField): Fatal errors generated by the task
 
     Relations:
@@ -270,7 +415,7 @@ class Task(Model):
     started_at = models.DateTimeField(null=True)
     finished_at = models.DateTimeField(null=True)
 
-    non_fatal_errors = JSONField(default=list)
+    non_fatal_errors_overflow = models.PositiveIntegerField(default=0)
     error = JSONField(null=True)
 
     parent = models.ForeignKey("Task", null=True, related_name="spawned_tasks",
@@ -278,6 +423,15 @@ class Task(Model):
     worker = models.ForeignKey("Worker", null=True, related_name="tasks",
                                on_delete=models.SET_NULL)
 
+    class Meta:
+        indexes = [
+            # listing tasks, optionally filtered by state, newest first
+            models.Index(fields=['created']),
+            models.Index(fields=['state', 'created']),
+            # purging finished tasks
+            models.Index(fields=['state', 'finished_at']),
+        ]
+
     @staticmethod
     def current():
         """
@@ -344,11 +498,45 @@ class Task(Model):
         """
         Release the reserved resources that are reserved by this task. If a reserved resource no
         longer has any tasks reserving it, delete it.
+
+        The reservations are locked first, so they are not deleted while they are reserved
+        concurrently for another task.
         """
-        for reservation in self.reserved_resources.all():
-            TaskReservedResource.objects.filter(task=self.id).delete()
-            if not reservation.tasks.exists():
-                reservation.delete()
+        with transaction.atomic():
+            # a subquery rather than a join, so only the reservations are locked
+            reserved = TaskReservedResource.objects.filter(task=self).values('resource_id')
+            reservations = ReservedResource.objects.select_for_update().filter(
+                pk__in=reserved).order_by('resource')
+            reservation_ids = [reservation.pk for reservation in reservations]
+            TaskReservedResource.objects.filter(task=self).delete()
+            ReservedResource.objects.filter(pk__in=reservation_ids, tasks__isnull=True).delete()
+
+
+class TaskNonFatalError(Model):
+    """
+    A non-fatal error which occurred while a task was running.
+
+    Errors are only ever appended, at most TASKING_CONSTANTS.NON_FATAL_ERROR_LIMIT per task.
+
+    Fields:
+
+        number (models.PositiveIntegerField): The position of the error among the errors of the
+            task, from 0.
+        error (pulpcore.app.fields.JSONField): The error, as serialized by
+            :func:`pulpcore.exceptions.exception_to_dict`.
+
+    Relations:
+
+        task (models.ForeignKey): The task the error occurred in.
+    """
+    number = models.PositiveIntegerField()
+    error = JSONField()
+
+    task = models.ForeignKey(Task, related_name='non_fatal_errors', on_delete=models.CASCADE)
+
+    class Meta:
+        unique_together = ('task', 'number')
+        ordering = ('number',)
 
 
 class CreatedResource(GenericRelationModel):
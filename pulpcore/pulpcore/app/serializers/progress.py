@@ -4,6 +4,7 @@ from rest_framework import serializers
 
 from pulpcore.app import models
 from pulpcore.app.serializers import ModelSerializer
+from pulpcore.common import TASK_STATES
 
 
 class ProgressReportSerializer(ModelSerializer):
@@ -42,3 +43,14 @@ class ProgressReportSerializer(ModelSerializer):
         # so it will not have its own endpoint, that's why
         # we need to explicitly define fields to exclude '_href' field.
         fields = ('message', 'state', 'total', 'done', 'suffix', 'task')
+
+    def to_representation(self, instance):
+        """
+        Represent a progress report, with the done count published while its task runs.
+
+        The done count is only saved from time to time while the task runs, and it is published
+        in Redis meanwhile, whether the progress report is used as a context manager or not.
+        """
+        if instance.task.state == TASK_STATES.RUNNING:
+            instance.load_published_done()
+        return super().to_representation(instance)
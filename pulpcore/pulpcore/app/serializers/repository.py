@@ -1,7 +1,6 @@
 from gettext import gettext as _
 
 from django.core import validators
-from django.db.models import Q
 
 from rest_framework import serializers
 from rest_framework.validators import UniqueValidator
@@ -233,21 +232,8 @@ class DistributionSerializer(ModelSerializer):
         )
 
     def _validate_path_overlap(self, path):
-        # look for any base paths nested in path
-        search = path.split("/")[0]
-        q = Q(base_path=search)
-        for subdir in path.split("/")[1:]:
-            search = "/".join((search, subdir))
-            q |= Q(base_path=search)
-
-        # look for any base paths that nest path
-        q |= Q(base_path__startswith='{}/'.format(path))
-        qs = models.Distribution.objects.filter(q)
-
-        if self.instance is not None:
-            qs = qs.exclude(pk=self.instance.pk)
-
-        match = qs.first()
+        exclude = self.instance.pk if self.instance is not None else None
+        match = models.Distribution.objects.overlapping(path, exclude=exclude)
         if match:
             raise serializers.ValidationError(detail=_("Overlaps with existing distribution '"
                                                        "{}'").format(match.name))
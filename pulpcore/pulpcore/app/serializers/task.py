@@ -46,9 +46,13 @@ class TaskSerializer(ModelSerializer):
         help_text=_("Timestamp of the when this task stopped execution."),
         read_only=True
     )
-    non_fatal_errors = serializers.JSONField(
+    non_fatal_errors = serializers.SerializerMethodField(
         help_text=_("A JSON Object of non-fatal errors encountered during the execution of this "
-                    "task."),
+                    "task.")
+    )
+    non_fatal_errors_overflow = serializers.IntegerField(
+        help_text=_("The number of non-fatal errors encountered during the execution of this "
+                    "task which are not listed, because there are too many."),
         read_only=True
     )
     error = serializers.JSONField(
@@ -86,12 +90,25 @@ class TaskSerializer(ModelSerializer):
     class Meta:
         model = models.Task
         fields = ModelSerializer.Meta.fields + ('state', 'started_at', 'finished_at',
-                                                'non_fatal_errors', 'error', 'worker', 'parent',
+                                                'non_fatal_errors', 'non_fatal_errors_overflow',
+                                                'error', 'worker', 'parent',
                                                 'spawned_tasks', 'progress_reports',
                                                 'created_resources')
         minimal_fields = ModelSerializer.Meta.fields + ('state', 'started_at', 'finished_at',
                                                         'worker', 'parent')
 
+    def get_non_fatal_errors(self, obj):
+        """
+        Get the non-fatal errors of a task.
+
+        Args:
+            obj (pulpcore.app.models.Task): The task.
+
+        Returns:
+            list: The serialized errors, in the order they were appended.
+        """
+        return [non_fatal_error.error for non_fatal_error in obj.non_fatal_errors.all()]
+
 
 class WorkerSerializer(ModelSerializer):
     _href = serializers.HyperlinkedIdentityField(view_name='workers-detail')
@@ -209,6 +209,11 @@ _DEFAULT_PULP_SETTINGS = {
         'PORT': 6379,
         'PASSWORD': ''
     },
+    'TASKING': {
+        'WORKER_CAPACITY': {},
+        'FORK_JOBS': True,
+        'TASK_RETENTION_DAYS': None,
+    },
     'PROFILING': {
         'ENABLED': False,
         'DIRECTORY': '/var/lib/pulp/c_profiles'
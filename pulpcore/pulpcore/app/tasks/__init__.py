@@ -1,3 +1,4 @@
 from pulpcore.app.tasks import base, repository  # noqa
 
 from .orphan import orphan_cleanup  # noqa
+from .purge import purge_tasks  # noqa
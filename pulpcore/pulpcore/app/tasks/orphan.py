@@ -1,10 +1,14 @@
-from pulpcore.app.models import Artifact, Content, ContentArtifact, ProgressBar, RepositoryContent
+from pulpcore.app.models import (Artifact, Content, ContentArtifact, ProgressBar, Publication,
+                                 RepositoryContent)
 
 
 def orphan_cleanup():
     """
     Delete all orphan Content and Artifact records.
     This task removes Artifact files from the filesystem as well.
+
+    The indexes of the publications which published artifacts of orphan Content are built again
+    once the Content is deleted.
     """
     # Content cleanup
     content = Content.objects.exclude(pk__in=RepositoryContent.objects.values_list('content_id',
@@ -12,7 +16,12 @@ def orphan_cleanup():
     progress_bar = ProgressBar(message='Clean up orphan Content', total=content.count(),
                                done=0, state='running')
     progress_bar.save()
+    publications = list(Publication.objects.filter(
+        complete=True, published_artifact__content_artifact__content__in=content).distinct())
     content.delete()
+    # before the files are removed, so they are never served from a stale index
+    for publication in publications:
+        publication.build_index()
     progress_bar.done = progress_bar.total
     progress_bar.state = 'completed'
     progress_bar.save()
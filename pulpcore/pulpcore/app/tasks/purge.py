@@ -0,0 +1,37 @@
+from datetime import timedelta
+from gettext import gettext as _
+
+from django.db import transaction
+from django.utils import timezone
+
+from pulpcore.app.models import ProgressBar, Task
+from pulpcore.common import TASK_FINAL_STATES
+
+
+# The number of tasks deleted per transaction.
+TASK_PURGE_BATCH_SIZE = 1000
+
+
+def purge_tasks(days):
+    """
+    Delete the tasks which finished more than a number of days ago.
+
+    The tasks are deleted in batches, each in its own transaction, with their progress reports,
+    created resources and non-fatal errors. The tasks they spawned are kept. Tasks still holding
+    reservations, e.g. when their reservations were not released yet, are kept until they are.
+
+    Args:
+        days (int): The number of days finished tasks are kept for.
+    """
+    finished_before = timezone.now() - timedelta(days=days)
+    tasks = Task.objects.filter(state__in=TASK_FINAL_STATES, finished_at__lt=finished_before) \
+        .exclude(reserved_resources__isnull=False)
+    with ProgressBar(message=_('Purge tasks'), total=tasks.count()) as bar:
+        while True:
+            batch = list(tasks.values_list('pk', flat=True)[:TASK_PURGE_BATCH_SIZE])
+            if not batch:
+                break
+            with transaction.atomic():
+                Task.objects.filter(pk__in=batch).delete()
+            bar.done += len(batch)
+            bar.save_done()
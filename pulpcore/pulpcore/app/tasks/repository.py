@@ -17,7 +17,10 @@ def delete(repo_id):
         repo_id (UUID): The name of the repository to be deleted
     """
 
-    models.Repository.objects.filter(pk=repo_id).delete()
+    with transaction.atomic():
+        models.Publication.objects.drop_indexes(
+            models.Publication.objects.filter(repository_version__repository=repo_id))
+        models.Repository.objects.filter(pk=repo_id).delete()
 
 
 def update(repo_id, partial=True, data=None):
@@ -67,6 +70,33 @@ def delete_version(pk):
         version.delete()
 
 
+def prune_versions(repository_pk, keep):
+    """
+    Delete all but the newest versions of a repository by squashing them into the oldest version
+    that is kept. The content set of each remaining version stays the same.
+
+    Args:
+        repository_pk (UUID): The primary key for the Repository to be pruned
+        keep (int): The number of complete versions to keep
+    """
+    repository = models.Repository.objects.get(pk=repository_pk)
+    versions = repository.versions.exclude(complete=False).order_by('-number')
+    try:
+        oldest_kept = versions[keep - 1]
+    except IndexError:
+        log.info(_('Repository %(r)s has no more than %(k)d versions. Nothing to do.'),
+                 {'r': repository.name, 'k': keep})
+        return
+
+    pruned = versions.filter(number__lt=oldest_kept.number).count()
+    log.info(_('Squashing %(n)d versions of repository %(r)s into version %(v)d'),
+             {'n': pruned, 'r': repository.name, 'v': oldest_kept.number})
+
+    with models.ProgressBar(message=_('Prune Repository Versions'), total=pruned) as bar:
+        bar.done = oldest_kept.squash_previous()
+        bar.save()
+
+
 def add_and_remove(repository_pk, add_content_units, remove_content_units):
     """
     Create a new repository version by adding and then removing content units.
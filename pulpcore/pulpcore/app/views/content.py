@@ -1,17 +1,19 @@
 import os
+import re
 
 from gettext import gettext as _
 from logging import getLogger, DEBUG
 
 from django.conf import settings
 from django.core.exceptions import ObjectDoesNotExist
-from django.http import (HttpResponse, HttpResponseForbidden, HttpResponseNotFound,
-                         StreamingHttpResponse)
+from django.http import (FileResponse, HttpResponse, HttpResponseForbidden,
+                         HttpResponseNotFound, StreamingHttpResponse)
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, parse_http_date_safe, quote_etag
 from django.views.generic import View
 
-from wsgiref.util import FileWrapper
-
-from pulpcore.app.models import Distribution
+from pulpcore.app.models import (Distribution, Publication, PublishedArtifact,
+                                 PublishedMetadata, RemoteArtifact)
 
 
 log = getLogger(__name__)
@@ -34,52 +36,58 @@ class ContentView(View):
 
     BASE_PATH = 'pulp/content'
 
-    @staticmethod
-    def _base_paths(path):
+    # The number of bytes read from a file for each block streamed.
+    BLOCK_SIZE = 262144
+
+    RANGE_REGEX = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+    def _match_distribution(self, path):
         """
-        Get a list of base paths used to match a distribution.
+        Match a distribution using the base paths of all distributions.
 
         Args:
             path (str): The path component of the URL.
 
         Returns:
-            list: Of base paths.
+            Distribution: The matched distribution.
 
+        Raises:
+            ObjectDoesNotExist: when not matched.
         """
-        tree = []
-        while True:
-            base = os.path.split(path.strip('/'))[0]
-            if not base:
-                break
-            tree.append(base)
-            path = base
-        return tree
+        try:
+            return Distribution.objects.match(path)
+        except ObjectDoesNotExist:
+            log.debug(_('Distribution not matched for {path}').format(path=path))
+            raise
 
-    def _match_distribution(self, path):
+    def _match_publication(self, path):
         """
-        Match a distribution using a list of base paths.
+        Match the distribution of a path and get the path relative to the published publication.
 
         Args:
             path (str): The path component of the URL.
 
         Returns:
-            Distribution: The matched distribution.
+            tuple: The matched Distribution and the relative path within its publication.
 
         Raises:
-            ObjectDoesNotExist: when not matched.
+            ObjectDoesNotExist: when not matched or nothing is published by the distribution.
         """
-        base_paths = self._base_paths(path)
-        try:
-            return Distribution.objects.get(base_path__in=base_paths)
-        except ObjectDoesNotExist:
-            log.debug(_('Distribution not matched for {path} using: {base_paths}').format(
-                path=path, base_paths=base_paths))
-            raise
+        distribution = self._match_distribution(path)
+        if not distribution.publication_id:
+            raise ObjectDoesNotExist()
+        rel_path = path.lstrip('/')
+        rel_path = rel_path[len(distribution.base_path):]
+        rel_path = rel_path.lstrip('/')
+        return distribution, rel_path
 
     def _match(self, path):
         """
         Match either a PublishedArtifact or PublishedMetadata.
 
+        The publication index is used when available. Otherwise, both are looked up by a single
+        query which only fetches the storage path.
+
         Args:
             path (str): The path component of the URL.
 
@@ -90,35 +98,137 @@ class ContentView(View):
             ObjectDoesNotExist: The referenced object does not exist.
 
         """
-        distribution = self._match_distribution(path)
-        publication = distribution.publication
-        if not publication:
-            raise ObjectDoesNotExist()
-        rel_path = path.lstrip('/')
-        rel_path = rel_path[len(distribution.base_path):]
-        rel_path = rel_path.lstrip('/')
-        # artifact
-        try:
-            pa = publication.published_artifact.get(relative_path=rel_path)
-        except ObjectDoesNotExist:
-            pass
-        else:
-            artifact = pa.content_artifact.artifact
-            if artifact.file:
-                return artifact.file.name
-            else:
-                raise ObjectDoesNotExist()
-        # metadata
-        pm = publication.published_metadata.get(relative_path=rel_path)
-        if pm.file:
-            return pm.file.name
-        else:
+        distribution, rel_path = self._match_publication(path)
+        storage_path = Publication.objects.resolve(distribution.publication_id, rel_path)
+        if storage_path:
+            return storage_path
+        lookup = dict(publication=distribution.publication_id, relative_path=rel_path)
+        artifact = PublishedArtifact.objects.filter(**lookup).values_list(
+            'content_artifact__artifact__file')
+        metadata = PublishedMetadata.objects.filter(**lookup).values_list('file')
+        for storage_path, in artifact.union(metadata, all=True):
+            if storage_path:
+                return storage_path
+        raise ObjectDoesNotExist()
+
+    def _match_remote(self, path):
+        """
+        Match a RemoteArtifact for a PublishedArtifact which is not stored.
+
+        Artifacts of content added using a deferred download policy are not stored until they are
+        downloaded from the remote.
+
+        Args:
+            path (str): The path component of the URL.
+
+        Returns:
+            RemoteArtifact: The matched remote artifact, with its content artifact and remote.
+
+        Raises:
+            ObjectDoesNotExist: The referenced object does not exist.
+        """
+        distribution, rel_path = self._match_publication(path)
+        remote_artifact = RemoteArtifact.objects.filter(
+            content_artifact__artifact__isnull=True,
+            content_artifact__published_artifact__publication=distribution.publication_id,
+            content_artifact__published_artifact__relative_path=rel_path
+        ).select_related('content_artifact', 'remote').first()
+        if remote_artifact is None:
             raise ObjectDoesNotExist()
+        return remote_artifact
+
+    @staticmethod
+    def _etag(storage_path, stat):
+        """
+        Get the entity tag of a stored file.
+
+        Artifacts are stored by sha256 digest, so the digest found in their storage path is used
+        as a strong entity tag. Other files get a weak entity tag built from their modification
+        time and size.
+
+        Args:
+            storage_path (str): The storage path of the requested object.
+            stat (os.stat_result): The status of the stored file.
+
+        Returns:
+            str: The quoted entity tag.
+        """
+        artifact_root = os.path.join(settings.MEDIA_ROOT, 'artifact', '')
+        if storage_path.startswith(artifact_root):
+            return quote_etag(storage_path[len(artifact_root):].replace('/', ''))
+        return 'W/"{m:x}-{s:x}"'.format(m=int(stat.st_mtime), s=stat.st_size)
+
+    def _range(self, size, etag, last_modified):
+        """
+        Get the byte range requested using the Range and If-Range headers.
+
+        Only single byte ranges are supported. Requests for multiple ranges are served the whole
+        file, as permitted by RFC 7233.
+
+        Args:
+            size (int): The size of the requested file.
+            etag (str): The entity tag of the requested file.
+            last_modified (int): The modification time of the requested file.
+
+        Returns:
+            tuple: The (start, stop) offsets of the requested range. None when the whole file is
+                requested.
+
+        Raises:
+            ValueError: when the requested range can not be satisfied.
+        """
+        match = self.RANGE_REGEX.match(self.request.META.get('HTTP_RANGE', ''))
+        if not match or match.groups() == ('', ''):
+            return None
+        if_range = self.request.META.get('HTTP_IF_RANGE')
+        if if_range:
+            strong_match = if_range == etag and not etag.startswith('W/')
+            if not strong_match and parse_http_date_safe(if_range) != last_modified:
+                return None
+        first, last = match.groups()
+        if not first:
+            if not int(last):
+                raise ValueError(_('Empty suffix byte range.'))
+            if not size:
+                raise ValueError(_('Suffix byte range of an empty file.'))
+            return max(size - int(last), 0), size
+        start = int(first)
+        if last and int(last) < start:
+            return None
+        if start >= size:
+            raise ValueError(_('Byte range starts after the end of the file.'))
+        stop = min(int(last) + 1, size) if last else size
+        return start, stop
+
+    def _read(self, file, length):
+        """
+        Read a number of bytes from a file in blocks, then close it.
+
+        Args:
+            file (file): An open file positioned at the first byte to be read.
+            length (int): The number of bytes to be read.
+
+        Yields:
+            bytes: Blocks of at most BLOCK_SIZE bytes.
+        """
+        with file:
+            while length > 0:
+                data = file.read(min(self.BLOCK_SIZE, length))
+                if not data:
+                    break
+                length -= len(data)
+                yield data
 
     def _stream(self, storage_path):
         """
         Get streaming response.
 
+        HEAD requests, conditional requests using the ETag and Last-Modified of the file, and
+        single byte range requests are supported. The file is only opened when content is sent.
+
+        Whole files are sent using a FileResponse so WSGI servers providing wsgi.file_wrapper
+        can send them without copying through Python, usually with sendfile().
+
         Args:
             storage_path (str): The storage path of the requested object.
 
@@ -127,13 +237,58 @@ class ContentView(View):
 
         """
         try:
-            file = FileWrapper(open(storage_path, 'rb'))
+            stat = os.stat(storage_path)
         except FileNotFoundError:
             return HttpResponseNotFound()
         except PermissionError:
             return HttpResponseForbidden()
-        response = StreamingHttpResponse(file)
-        response['Content-Length'] = os.path.getsize(storage_path)
+
+        etag = self._etag(storage_path, stat)
+        last_modified = int(stat.st_mtime)
+        headers = {
+            'ETag': etag,
+            'Last-Modified': http_date(last_modified),
+            'Accept-Ranges': 'bytes',
+        }
+
+        response = get_conditional_response(self.request, etag=etag, last_modified=last_modified)
+        if response is not None:
+            for name, value in headers.items():
+                response[name] = value
+            return response
+
+        try:
+            byte_range = self._range(stat.st_size, etag, last_modified)
+        except ValueError:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = 'bytes */{size}'.format(size=stat.st_size)
+            return response
+        start, stop = byte_range or (0, stat.st_size)
+
+        if self.request.method == 'HEAD':
+            response = HttpResponse()
+        else:
+            try:
+                file = open(storage_path, 'rb')
+            except FileNotFoundError:
+                return HttpResponseNotFound()
+            except PermissionError:
+                return HttpResponseForbidden()
+            if byte_range:
+                file.seek(start)
+                response = StreamingHttpResponse(self._read(file, stop - start))
+            else:
+                # Lets the WSGI server send the file using wsgi.file_wrapper (sendfile).
+                response = FileResponse(file)
+                response.block_size = self.BLOCK_SIZE
+
+        if byte_range:
+            response.status_code = 206
+            response['Content-Range'] = 'bytes {start}-{end}/{size}'.format(
+                start=start, end=stop - 1, size=stat.st_size)
+        for name, value in headers.items():
+            response[name] = value
+        response['Content-Length'] = stop - start
         response['Content-Disposition'] = \
             'attachment; filename={n}'.format(n=os.path.basename(storage_path))
         return response
@@ -195,6 +350,7 @@ class ContentView(View):
 
         Returns:
             django.http.StreamingHttpResponse: on found.
+            django.http.HttpResponseNotModified: on not-modified.
             django.http.HttpResponseNotFound: on not-found.
             django.http.HttpResponseForbidden: on forbidden.
 
@@ -6,6 +6,7 @@ from urllib.parse import urlparse
 from pulpcore.app import tasks
 from pulpcore.app.models import MasterModel
 from pulpcore.app.response import OperationPostponedResponse
+from pulpcore.common import TASK_PRIORITIES
 from pulpcore.tasking.tasks import enqueue_with_reservation
 
 from django.urls import resolve, Resolver404
@@ -266,7 +267,8 @@ class AsyncUpdateMixin:
         async_result = enqueue_with_reservation(
             tasks.base.general_update, [instance],
             args=(pk, app_label, serializer.__class__.__name__),
-            kwargs={'data': request.data, 'partial': partial}
+            kwargs={'data': request.data, 'partial': partial},
+            priority=TASK_PRIORITIES.HIGH
         )
         return OperationPostponedResponse(async_result, request)
 
@@ -32,6 +32,7 @@ from pulpcore.app.serializers import (
 )
 from pulpcore.app.viewsets import NamedModelViewSet, AsyncUpdateMixin, AsyncRemoveMixin
 from pulpcore.app.viewsets.base import NAME_FILTER_OPTIONS, DATETIME_FILTER_OPTIONS
+from pulpcore.common import TASK_PRIORITIES
 from pulpcore.tasking.tasks import enqueue_with_reservation
 
 
@@ -66,7 +67,8 @@ class RepositoryViewSet(NamedModelViewSet,
         async_result = enqueue_with_reservation(
             tasks.repository.update, [instance],
             args=(instance.id, ),
-            kwargs={'data': request.data, 'partial': partial}
+            kwargs={'data': request.data, 'partial': partial},
+            priority=TASK_PRIORITIES.HIGH
         )
         return OperationPostponedResponse(async_result, request)
 
@@ -81,6 +83,24 @@ class RepositoryViewSet(NamedModelViewSet,
         )
         return OperationPostponedResponse(async_result, request)
 
+    @decorators.detail_route(methods=('post',))
+    def prune_versions(self, request, pk):
+        """
+        Generates a Task to squash all but the newest `keep` versions of a Repository
+        """
+        repo = self.get_object()
+        try:
+            keep = int(request.data['keep'])
+        except (KeyError, TypeError, ValueError):
+            raise serializers.ValidationError(detail=_('An integer value for keep is required.'))
+        if keep < 1:
+            raise serializers.ValidationError(detail=_('At least one version must be kept.'))
+        async_result = enqueue_with_reservation(
+            tasks.repository.prune_versions, [repo],
+            kwargs={'repository_pk': repo.pk, 'keep': keep}
+        )
+        return OperationPostponedResponse(async_result, request)
+
 
 class RepositoryVersionContentFilter(Filter):
     """
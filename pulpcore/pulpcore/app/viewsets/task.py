@@ -1,16 +1,23 @@
+from gettext import gettext as _
+from urllib.parse import urlparse
+from uuid import UUID
+
+from django.urls import resolve, Resolver404
 from django_filters.rest_framework import filters, filterset, DjangoFilterBackend
-from rest_framework import status, mixins
-from rest_framework.decorators import detail_route
+from rest_framework import serializers, status, mixins
+from rest_framework.decorators import detail_route, list_route
 from rest_framework.filters import OrderingFilter
 from rest_framework.response import Response
 
 from pulpcore.common import TASK_INCOMPLETE_STATES
 
 from pulpcore.app.models import Task, Worker
-from pulpcore.app.serializers import TaskSerializer, WorkerSerializer
+from pulpcore.app.models.progress import wait_for_progress
+from pulpcore.app.serializers import ProgressReportSerializer, TaskSerializer, WorkerSerializer
 from pulpcore.app.viewsets import NamedModelViewSet
 from pulpcore.app.viewsets.base import NAME_FILTER_OPTIONS, DATETIME_FILTER_OPTIONS
 from pulpcore.app.viewsets.custom_filters import HyperlinkRelatedFilter
+from pulpcore.tasking.constants import TASKING_CONSTANTS
 from pulpcore.tasking.util import cancel as cancel_task
 
 
@@ -43,12 +50,99 @@ class TaskViewSet(NamedModelViewSet,
     filter_backends = (OrderingFilter, DjangoFilterBackend)
     ordering = ('-created')
 
+    def get_queryset(self):
+        """
+        Gets a QuerySet based on the current request.
+
+        The errors are not listed, see TaskSerializer.Meta.minimal_fields, so they are neither
+        fetched nor decoded when listing tasks.
+
+        Returns:
+            django.db.models.query.QuerySet: The tasks.
+        """
+        qs = super().get_queryset()
+        if self.action == 'list':
+            qs = qs.defer('error')
+        return qs
+
     @detail_route(methods=('post',))
     def cancel(self, request, pk=None):
         task = self.get_object()
         cancel_task(task.pk)
         return Response(status=status.HTTP_204_NO_CONTENT)
 
+    @detail_route(methods=('get',))
+    def progress(self, request, pk=None):
+        """
+        Get the progress reports of a task, once they are updated.
+
+        The response includes a `version` of the progress. When it is passed back, e.g.
+        `?version=3`, the response is delayed until the progress is updated, the task ends, or
+        `wait` seconds (5 at most) pass, so clients can follow the progress with few requests.
+        """
+        task = self.get_object()
+        try:
+            version = request.query_params.get('version')
+            version = None if version is None else int(version)
+            wait = float(request.query_params.get('wait', TASKING_CONSTANTS.PROGRESS_WAIT_LIMIT))
+        except ValueError:
+            raise serializers.ValidationError(detail=_('version and wait must be numbers.'))
+        wait = max(0, min(wait, TASKING_CONSTANTS.PROGRESS_WAIT_LIMIT))
+        version = wait_for_progress(task.pk, version, wait)
+        task.refresh_from_db(fields=['state'])
+        progress_reports = ProgressReportSerializer(task.progress_reports.all(), many=True,
+                                                    context={'request': request})
+        return Response({'version': version, 'state': task.state,
+                         'progress_reports': progress_reports.data})
+
+    @list_route(methods=('post',), url_path='cancel')
+    def cancel_list(self, request):
+        """
+        Cancel the incomplete tasks matching the filters, e.g. `?state=waiting&worker=...`, and
+        listed by href in the `tasks` field of the body, if any.
+
+        Filters or tasks are required, so that all the tasks are not canceled by mistake.
+        """
+        filtered = set(request.query_params) & set(self.filter_class.base_filters)
+        hrefs = request.data.get('tasks')
+        if not filtered and not hrefs:
+            raise serializers.ValidationError(
+                detail=_('Filters or a list of tasks are required to cancel tasks.'))
+        if hrefs and not isinstance(hrefs, list):
+            raise serializers.ValidationError(detail=_('tasks must be a list of task hrefs.'))
+        tasks = self.filter_queryset(self.get_queryset()).filter(state__in=TASK_INCOMPLETE_STATES)
+        if hrefs:
+            tasks = tasks.filter(pk__in=[self._task_pk(href) for href in hrefs])
+        for pk in tasks.values_list('pk', flat=True):
+            cancel_task(pk)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+    @staticmethod
+    def _task_pk(href):
+        """
+        Get the pk of a task from its href.
+
+        Args:
+            href (str): The href of the task.
+
+        Returns:
+            str: The pk of the task.
+
+        Raises:
+            rest_framework.exceptions.ValidationError: When the href is not the href of a task.
+        """
+        try:
+            match = resolve(urlparse(href).path)
+        except (Resolver404, AttributeError):
+            match = None
+        if match is None or match.url_name != 'tasks-detail':
+            raise serializers.ValidationError(detail=_('URI not valid: {u}').format(u=href))
+        try:
+            return str(UUID(match.kwargs['pk']))
+        except ValueError:
+            raise serializers.ValidationError(
+                detail=_('UUID invalid: {u}').format(u=match.kwargs['pk']))
+
     def destroy(self, request, pk=None):
         task = self.get_object()
         if task.state in TASK_INCOMPLETE_STATES:
@@ -0,0 +1,41 @@
+"""
+The standalone content app.
+
+An asyncio (aiohttp) application serving the content of distributions, like the ContentView of the
+WSGI application does. Each process handles many concurrent downloads, and the app can be deployed
+and scaled separately from the REST API. For example, using gunicorn::
+
+    $ gunicorn pulpcore.content:server --bind 'localhost:8080' \\
+        --worker-class 'aiohttp.GunicornWebWorker'
+"""
+import os
+
+import django  # noqa otherwise E402: module level not at top of file
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'pulpcore.app.settings')  # noqa
+django.setup()  # noqa otherwise E402: module level not at top of file
+
+from aiohttp import web  # noqa: E402
+
+from pulpcore.app.models import Distribution  # noqa: E402
+from pulpcore.app.views import ContentView  # noqa: E402
+
+from .handler import Handler  # noqa: E402
+
+
+async def server(*args, **kwargs):
+    """
+    Build the content app.
+
+    Args:
+        args (tuple): unused positional arguments
+        kwargs (dict): unused keyword arguments
+
+    Returns:
+        aiohttp.web.Application: The content app.
+    """
+    Distribution.objects.subscribe()
+    app = web.Application()
+    handler = Handler()
+    app.router.add_get('/{base}/{{path:.+}}'.format(base=ContentView.BASE_PATH),
+                       handler.stream_content)
+    return app
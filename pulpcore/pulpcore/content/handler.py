@@ -0,0 +1,434 @@
+import asyncio
+import os
+import tempfile
+
+from functools import partial
+
+from gettext import gettext as _
+from logging import getLogger
+
+from aiohttp.web import (FileResponse, HTTPBadGateway, HTTPForbidden, HTTPNotFound,
+                         StreamResponse)
+from django.conf import settings
+from django.core.exceptions import ObjectDoesNotExist
+from django.db import close_old_connections, IntegrityError, transaction
+from redis.exceptions import RedisError
+
+from pulpcore.app.models import Artifact, ContentArtifact, Publication
+from pulpcore.app.views import ContentView
+
+
+log = getLogger(__name__)
+
+
+class Fetch:
+    """
+    An on-demand download of an artifact, shared by all the requests streaming it.
+
+    The downloaded data is written to a temporary file, which each request reads from its own
+    offset as it grows. The fetch is the ``custom_file_object`` of the downloader, which computes
+    the digests of the data and calls write(), flush(), fileno() and close() as it would on its own
+    temporary file.
+
+    Attributes:
+        path (str): The path to the temporary file.
+        remote (pulpcore.plugin.models.Remote): The detail remote used to download.
+        size (int): The number of bytes downloaded.
+        task (asyncio.Task): The download task.
+    """
+
+    def __init__(self):
+        self._file = tempfile.NamedTemporaryFile(dir=settings.SERVER['WORKING_DIRECTORY'],
+                                                 delete=False)
+        self.path = self._file.name
+        # Kept open for readers when the file is moved into the artifact store.
+        self._fd = os.open(self.path, os.O_RDONLY)
+        self._readers = 0
+        self._changed = asyncio.get_event_loop().create_future()
+        self.remote = None
+        self.size = 0
+        self.task = None
+
+    @property
+    def changed(self):
+        """
+        A future done when data is downloaded or when the download finishes.
+        """
+        return self._changed
+
+    def _notify(self):
+        changed = self._changed
+        self._changed = asyncio.get_event_loop().create_future()
+        changed.set_result(None)
+
+    def write(self, data):
+        self._file.write(data)
+        self._file.flush()
+        self.size += len(data)
+        self._notify()
+
+    def flush(self):
+        self._file.flush()
+
+    def fileno(self):
+        return self._file.fileno()
+
+    def close(self):
+        self._file.close()
+
+    def read(self, size, offset):
+        """
+        Read downloaded data.
+
+        Args:
+            size (int): The number of bytes to read.
+            offset (int): The offset of the first byte to read.
+
+        Returns:
+            bytes: The data read.
+        """
+        return os.pread(self._fd, size, offset)
+
+    def attach(self):
+        """
+        Register a request streaming the download.
+        """
+        self._readers += 1
+
+    def detach(self):
+        """
+        Unregister a request streaming the download.
+        """
+        self._readers -= 1
+        self._release()
+
+    def finished(self):
+        """
+        Notify the requests streaming the download that it is finished.
+        """
+        self._notify()
+        self._release()
+
+    def _release(self):
+        if not self._readers and self.task.done() and self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+
+class Handler:
+    """
+    Serves the content of distributions for the standalone content app.
+
+    Distributions and published files are matched exactly as the ContentView does. The blocking
+    database lookups run in the default executor of the event loop, and files are sent by the
+    aiohttp FileResponse, which uses sendfile() and supports HEAD, range and conditional requests.
+
+    Published artifacts which are not stored, because their content was added using a deferred
+    download policy, are downloaded from the remote on demand. The data is streamed to the client
+    while it is written to the artifact store, and the Artifact is saved once the download
+    completes and is validated. Concurrent requests for the same artifact share one download.
+    """
+
+    def __init__(self):
+        self._view = ContentView()
+        # Detail remotes (and their downloader factories) keyed by pk.
+        self._remotes = {}
+        # Downloads in progress keyed by ContentArtifact pk.
+        self._fetches = {}
+
+    async def stream_content(self, request):
+        """
+        Stream the content matching a request.
+
+        Args:
+            request (aiohttp.web.Request): A request for a published file.
+
+        Returns:
+            aiohttp.web.StreamResponse: The published file.
+
+        Raises:
+            aiohttp.web.HTTPNotFound: when no published file matches.
+            aiohttp.web.HTTPForbidden: when the file can not be read.
+        """
+        path = request.match_info['path']
+        loop = asyncio.get_event_loop()
+        storage_path = await loop.run_in_executor(None, self._match, path)
+        if storage_path:
+            return FileResponse(storage_path, chunk_size=ContentView.BLOCK_SIZE)
+        remote_artifact, remote = await loop.run_in_executor(None, self._match_remote, path)
+        remote = self._cache_remote(remote)
+        return await self._stream_remote_artifact(request, remote_artifact, remote)
+
+    def _match(self, path):
+        """
+        Match the storage path of a published file.
+
+        Runs in an executor thread. Database connections are closed when they are obsolete, as
+        Django does at the end of each request in the WSGI application.
+
+        Args:
+            path (str): The path component of the URL, relative to the content app.
+
+        Returns:
+            str: The storage path of the matched file. None when no stored file matches.
+
+        Raises:
+            aiohttp.web.HTTPNotFound: when the matched file is missing.
+            aiohttp.web.HTTPForbidden: when the file can not be read.
+        """
+        try:
+            storage_path = self._view._match(path)
+        except ObjectDoesNotExist:
+            return None
+        finally:
+            close_old_connections()
+        if not os.path.isfile(storage_path):
+            log.debug(_('Published file {path} not found at {storage_path}').format(
+                path=path, storage_path=storage_path))
+            raise HTTPNotFound()
+        if not os.access(storage_path, os.R_OK):
+            raise HTTPForbidden()
+        return storage_path
+
+    def _match_remote(self, path):
+        """
+        Match the remote artifact of a published artifact which is not stored.
+
+        Runs in an executor thread.
+
+        Args:
+            path (str): The path component of the URL, relative to the content app.
+
+        Returns:
+            tuple: The matched RemoteArtifact and its detail Remote, which is the cached one unless
+                the remote has been updated since.
+
+        Raises:
+            aiohttp.web.HTTPNotFound: when no published file matches.
+        """
+        try:
+            remote_artifact = self._view._match_remote(path)
+            remote = self._remotes.get(remote_artifact.remote_id)
+            if remote is None or remote.last_updated != remote_artifact.remote.last_updated:
+                remote = remote_artifact.remote.cast()
+        except ObjectDoesNotExist:
+            raise HTTPNotFound()
+        finally:
+            close_old_connections()
+        return remote_artifact, remote
+
+    def _cache_remote(self, remote):
+        """
+        Cache a detail remote, so its downloader factory and aiohttp session are reused.
+
+        The aiohttp session of the remote replaced is closed once its downloads are finished.
+
+        Args:
+            remote (pulpcore.plugin.models.Remote): The detail remote matched.
+
+        Returns:
+            pulpcore.plugin.models.Remote: The cached detail remote.
+        """
+        cached = self._remotes.get(remote.pk)
+        if cached is not None and cached.last_updated == remote.last_updated:
+            return cached
+        self._remotes[remote.pk] = remote
+        if cached is not None:
+            asyncio.ensure_future(self._close_remote(cached))
+        return remote
+
+    async def _close_remote(self, remote):
+        """
+        Close the aiohttp session of a remote once its downloads are finished.
+
+        Args:
+            remote (pulpcore.plugin.models.Remote): A detail remote no longer cached.
+        """
+        tasks = [fetch.task for fetch in self._fetches.values() if fetch.remote is remote]
+        if tasks:
+            await asyncio.wait(tasks)
+        # The downloader factory, and its session, are created on first use.
+        factory = vars(remote).get('_download_factory')
+        if factory is not None:
+            await factory.close()
+
+    async def _stream_remote_artifact(self, request, remote_artifact, remote):
+        """
+        Stream an artifact while it is downloaded from the remote.
+
+        Requests for an artifact already being downloaded stream that download from its start.
+        The download continues, and the artifact is stored, when the clients go away.
+
+        Args:
+            request (aiohttp.web.Request): A request for a published artifact.
+            remote_artifact (pulpcore.app.models.RemoteArtifact): The artifact to download.
+            remote (pulpcore.plugin.models.Remote): The detail remote used to download.
+
+        Returns:
+            aiohttp.web.StreamResponse: The downloaded artifact.
+
+        Raises:
+            aiohttp.web.HTTPBadGateway: when the download fails before any data is received.
+        """
+        headers = {
+            'Content-Disposition': 'attachment; filename={n}'.format(
+                n=os.path.basename(remote_artifact.content_artifact.relative_path)),
+        }
+        response = StreamResponse(headers=headers)
+        if remote_artifact.size:
+            response.content_length = remote_artifact.size
+        if request.method == 'HEAD':
+            return response
+
+        fetch = self._fetches.get(remote_artifact.content_artifact_id)
+        if fetch is None:
+            fetch = self._fetch(remote_artifact, remote)
+        fetch.attach()
+        try:
+            return await self._stream_fetch(request, response, fetch)
+        finally:
+            fetch.detach()
+
+    def _fetch(self, remote_artifact, remote):
+        """
+        Start downloading an artifact.
+
+        Args:
+            remote_artifact (pulpcore.app.models.RemoteArtifact): The artifact to download.
+            remote (pulpcore.plugin.models.Remote): The detail remote used to download.
+
+        Returns:
+            Fetch: The started download.
+        """
+        key = remote_artifact.content_artifact_id
+        fetch = Fetch()
+        fetch.remote = remote
+        fetch.task = asyncio.ensure_future(self._download(fetch, remote_artifact, remote))
+        fetch.task.add_done_callback(partial(self._fetched, key))
+        self._fetches[key] = fetch
+        return fetch
+
+    def _fetched(self, key, task):
+        """
+        Called when the download of an artifact is finished, successful or not.
+
+        Args:
+            key (uuid.UUID): The pk of the ContentArtifact downloaded.
+            task (asyncio.Task): The download task.
+        """
+        fetch = self._fetches.pop(key)
+        fetch.finished()
+        # Failures are logged by the download, and raised by each request streaming it.
+        if not task.cancelled():
+            task.exception()
+
+    async def _stream_fetch(self, request, response, fetch):
+        """
+        Stream the data of a download as it is written.
+
+        The last byte is held back until the download is validated, so clients never receive a
+        complete body for an invalid artifact.
+
+        Args:
+            request (aiohttp.web.Request): A request for a published artifact.
+            response (aiohttp.web.StreamResponse): The response to the request.
+            fetch (Fetch): The download.
+
+        Returns:
+            aiohttp.web.StreamResponse: The response to the request.
+
+        Raises:
+            aiohttp.web.HTTPBadGateway: when the download fails before any data is received.
+        """
+        while not fetch.size and not fetch.task.done():
+            await asyncio.shield(fetch.changed)
+        if fetch.task.done() and (fetch.task.cancelled() or fetch.task.exception()):
+            raise HTTPBadGateway()
+        await response.prepare(request)
+        offset = 0
+        while True:
+            changed = fetch.changed
+            done = fetch.task.done()
+            if done:
+                # Raises when the download failed after the response started, which aborts it.
+                fetch.task.result()
+            end = fetch.size if done else fetch.size - 1
+            while offset < end:
+                data = fetch.read(min(ContentView.BLOCK_SIZE, end - offset), offset)
+                await response.write(data)
+                offset += len(data)
+            if done:
+                break
+            await asyncio.shield(changed)
+        await response.write_eof()
+        return response
+
+    async def _download(self, fetch, remote_artifact, remote):
+        """
+        Download an artifact and store it.
+
+        Args:
+            fetch (Fetch): The download the data is written to.
+            remote_artifact (pulpcore.app.models.RemoteArtifact): The artifact to download.
+            remote (pulpcore.plugin.models.Remote): The detail remote used to download.
+
+        Raises:
+            Exception: Any exception emitted while downloading, including validation errors.
+        """
+        expected_digests = {}
+        for field in Artifact.DIGEST_FIELDS:
+            digest = getattr(remote_artifact, field)
+            if digest:
+                expected_digests[field] = digest
+        try:
+            downloader = remote.get_downloader(
+                remote_artifact.url,
+                custom_file_object=fetch,
+                expected_digests=expected_digests,
+                expected_size=remote_artifact.size)
+            await downloader.run()
+            loop = asyncio.get_event_loop()
+            await loop.run_in_executor(
+                None,
+                self._save_artifact,
+                remote_artifact.content_artifact_id,
+                fetch.path,
+                downloader.artifact_attributes)
+        except Exception:
+            log.exception(_('Download of {url} failed').format(url=remote_artifact.url))
+            raise
+        finally:
+            fetch.close()
+            if os.path.exists(fetch.path):
+                os.remove(fetch.path)
+
+    @staticmethod
+    def _save_artifact(content_artifact_pk, path, attributes):
+        """
+        Save a downloaded artifact and associate it with its content.
+
+        Runs in an executor thread. The artifact may have been stored concurrently, in which case
+        the stored one is associated. The indexes of the publications are then updated, so the
+        artifact is no longer looked up in the database.
+
+        Args:
+            content_artifact_pk (uuid.UUID): The pk of the ContentArtifact without artifact.
+            path (str): The path to the downloaded file.
+            attributes (dict): The size and digests of the downloaded file.
+        """
+        try:
+            artifact = Artifact(file=path, **attributes)
+            try:
+                with transaction.atomic():
+                    artifact.save()
+            except IntegrityError:
+                artifact = Artifact.objects.get(sha256=attributes['sha256'])
+            stored = ContentArtifact.objects.filter(
+                pk=content_artifact_pk, artifact__isnull=True).update(artifact=artifact)
+            if stored:
+                try:
+                    Publication.objects.index_artifact(content_artifact_pk, artifact.file.name)
+                except RedisError:
+                    log.exception(_('Indexing of artifact {pk} failed').format(pk=artifact.pk))
+        finally:
+            close_old_connections()
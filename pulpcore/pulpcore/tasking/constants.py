@@ -9,6 +9,45 @@ TASKING_CONSTANTS = SimpleNamespace(
     WORKER_TTL=30,
     # The amount of time (in seconds) between checks
     JOB_MONITORING_INTERVAL=5,
+    # The Redis sorted set of the last heartbeat time of each worker
+    HEARTBEATS_KEY='pulp:workers:heartbeats',
+    # The Redis key set by the worker checking for missing workers
+    WORKER_WATCHER_KEY='pulp:workers:watcher',
+    # The amount of time (in seconds) between checks for missing workers
+    WORKER_WATCHER_INTERVAL=10,
+    # The amount of time (in seconds) a running job has to run to weigh one more job in the load
+    # of its worker
+    RUNNING_JOB_LOAD_INTERVAL=60,
     # The Redis key used to force-kill a job
-    KILL_KEY="rq:jobs:kill"
+    KILL_KEY="rq:jobs:kill:{job_id}",
+    # The Redis key storing the dispatch arguments of a waiting task
+    WAITING_TASK_KEY='pulp:tasking:waiting:task:{task_id}',
+    # The Redis sorted set of the tasks waiting for a resource, in the order they get it
+    RESOURCE_LINE_KEY='pulp:tasking:line:{resource}',
+    # The Redis counter ordering the waiting tasks of a priority
+    RESOURCE_LINE_SEQUENCE_KEY='pulp:tasking:line-sequence',
+    # The Redis sorted set of the tasks waiting for a worker without reservations, in the order
+    # they get one
+    WAITING_WORKER_KEY='pulp:tasking:waiting:worker',
+    # The Redis sorted set of the tasks waiting for all the reservations to be released
+    WAITING_NO_RESERVATION_KEY='pulp:tasking:waiting:no-reservation',
+    # The maximum number of non-fatal errors recorded for a task, the others are only counted
+    NON_FATAL_ERROR_LIMIT=1000,
+    # The number of non-fatal errors buffered by a task before they are recorded
+    NON_FATAL_ERROR_BATCH_SIZE=100,
+    # The amount of time (in seconds) after which buffered non-fatal errors are recorded
+    NON_FATAL_ERROR_FLUSH_INTERVAL=5,
+    # The Redis key set when the purge of old tasks is dispatched
+    TASK_PURGE_KEY='pulp:tasking:purge',
+    # The amount of time (in seconds) between purges of old tasks
+    TASK_PURGE_INTERVAL=3600,
+    # The Redis hash of the done count of each progress report of a running task
+    PROGRESS_KEY='pulp:tasking:progress:{task_id}',
+    # The Redis channel publishing the updates of the progress of a task
+    PROGRESS_CHANNEL='pulp:tasking:progress:{task_id}:updates',
+    # The amount of time (in seconds) the progress of a task is kept after its last update
+    PROGRESS_TTL=86400,
+    # The maximum amount of time (in seconds) a client waits for an update of the progress of a
+    # task, which holds an API worker meanwhile
+    PROGRESS_WAIT_LIMIT=5
 )
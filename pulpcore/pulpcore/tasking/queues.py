@@ -0,0 +1,33 @@
+from pulpcore.common import TASK_PRIORITIES, TASK_PRIORITY_ORDER
+
+
+def queue_name(name, priority=TASK_PRIORITIES.DEFAULT):
+    """
+    Get the name of the RQ queue of a worker, or of the resource manager, for a task priority.
+
+    The queue for the default priority is named after the worker, and the queues for the other
+    priorities are suffixed with the priority.
+
+    Args:
+        name (str): The name of the worker, or 'resource_manager'.
+        priority (str): A task priority, one of TASK_PRIORITIES.
+
+    Returns:
+        str: The name of the queue.
+    """
+    if priority == TASK_PRIORITIES.DEFAULT:
+        return name
+    return '{name}:{priority}'.format(name=name, priority=priority)
+
+
+def queue_names(name):
+    """
+    Get the names of the RQ queues of a worker, or of the resource manager.
+
+    Args:
+        name (str): The name of the worker, or 'resource_manager'.
+
+    Returns:
+        list: The names of the queues, from the highest priority to the lowest.
+    """
+    return [queue_name(name, priority) for priority in TASK_PRIORITY_ORDER]
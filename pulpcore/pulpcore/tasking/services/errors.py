@@ -0,0 +1,67 @@
+"""
+Buffered recording of the non-fatal errors of tasks.
+
+Errors are buffered in the memory of the process running the task, and recorded in batches of
+TASKING_CONSTANTS.NON_FATAL_ERROR_BATCH_SIZE, or once
+TASKING_CONSTANTS.NON_FATAL_ERROR_FLUSH_INTERVAL has passed since the last batch. The worker
+records the remaining errors when the task ends.
+"""
+import time
+
+from django.db import transaction
+from django.db.models import F
+
+from pulpcore.app.models import Task, TaskNonFatalError
+from pulpcore.tasking.constants import TASKING_CONSTANTS
+
+
+# Serialized errors not recorded yet, keyed by task id.
+_buffered = {}
+
+# The time the errors of each task were last recorded, keyed by task id.
+_flushed_at = {}
+
+
+def append_non_fatal_error(task_id, error):
+    """
+    Buffer a non-fatal error of a task, and record the buffered errors when due.
+
+    Args:
+        task_id (str): The id of the task.
+        error (dict): The error, as serialized by :func:`pulpcore.exceptions.exception_to_dict`.
+    """
+    task_id = str(task_id)
+    errors = _buffered.setdefault(task_id, [])
+    errors.append(error)
+    flushed_at = _flushed_at.setdefault(task_id, time.monotonic())
+    if len(errors) >= TASKING_CONSTANTS.NON_FATAL_ERROR_BATCH_SIZE or \
+            time.monotonic() - flushed_at >= TASKING_CONSTANTS.NON_FATAL_ERROR_FLUSH_INTERVAL:
+        flush_non_fatal_errors(task_id)
+
+
+def flush_non_fatal_errors(task_id):
+    """
+    Record the buffered non-fatal errors of a task.
+
+    The errors are appended after the recorded ones. Once the task has
+    TASKING_CONSTANTS.NON_FATAL_ERROR_LIMIT errors recorded, the others are only counted in
+    :attr:`~pulpcore.app.models.Task.non_fatal_errors_overflow`.
+
+    Args:
+        task_id (str): The id of the task.
+    """
+    task_id = str(task_id)
+    errors = _buffered.pop(task_id, None)
+    _flushed_at.pop(task_id, None)
+    if not errors:
+        return
+    with transaction.atomic():
+        recorded = TaskNonFatalError.objects.filter(task_id=task_id).count()
+        kept = errors[:max(TASKING_CONSTANTS.NON_FATAL_ERROR_LIMIT - recorded, 0)]
+        TaskNonFatalError.objects.bulk_create(
+            TaskNonFatalError(task_id=task_id, number=recorded + number, error=error)
+            for number, error in enumerate(kept))
+        overflow = len(errors) - len(kept)
+        if overflow:
+            Task.objects.filter(pk=task_id).update(
+                non_fatal_errors_overflow=F('non_fatal_errors_overflow') + overflow)
@@ -1,9 +1,14 @@
 from gettext import gettext as _
 import logging
 
+from django.conf import settings
+
 from pulpcore.app.models import Worker
-from pulpcore.common import TASK_INCOMPLETE_STATES
+from pulpcore.app.tasks import purge_tasks
+from pulpcore.common import TASK_INCOMPLETE_STATES, TASK_PRIORITIES
+from pulpcore.tasking import connection
 from pulpcore.tasking.constants import TASKING_CONSTANTS
+from pulpcore.tasking.tasks import enqueue_with_reservation, wake_waiting_tasks
 from pulpcore.tasking.util import cancel
 
 
@@ -26,45 +31,54 @@ def handle_worker_heartbeat(worker_name):
     """
     This is a generic function for updating worker heartbeat records.
 
-    Existing Worker objects are searched for one to update. If an existing one is found, it is
-    updated. Otherwise a new Worker entry is created. Logging at the info level is also done.
+    The heartbeat is recorded in Redis. The Worker entry is only written when the worker starts or
+    comes back online, in which case it is created, or updated, and logging at the info level is
+    also done.
+
+    Tasks waiting for a worker are dispatched again when a worker is discovered or comes back
+    online.
 
     Args:
         worker_name (str): The hostname of the worker
     """
-    worker, created = Worker.objects.get_or_create(name=worker_name)
-
-    if created:
-        _logger.info(_("New worker '{name}' discovered").format(name=worker_name))
-    elif worker.online is False:
-        worker.gracefully_stopped = False
-        worker.cleaned_up = False
-        worker.save()
-        _logger.info(_("Worker '{name}' is back online.").format(name=worker_name))
+    if Worker.objects.heartbeat(worker_name):
+        worker, created = Worker.objects.get_or_create(name=worker_name)
 
-    worker.save_heartbeat()
+        if created:
+            _logger.info(_("New worker '{name}' discovered").format(name=worker_name))
+        else:
+            worker.gracefully_stopped = False
+            worker.cleaned_up = False
+            worker.save()
+            _logger.info(_("Worker '{name}' is back online.").format(name=worker_name))
 
-    msg = _("Worker heartbeat from '{name}' at time {timestamp}").format(
-        timestamp=worker.last_heartbeat,
-        name=worker_name
-    )
+        wake_waiting_tasks()
 
-    _logger.debug(msg)
+    _logger.debug(_("Worker heartbeat from '{name}'").format(name=worker_name))
 
 
 def check_worker_processes():
     """
     Look for missing Pulp worker processes, log and cleanup as needed.
 
-    To find a missing Worker process, filter the Workers model for entries older than
-    utcnow() - WORKER_TTL. The heartbeat times are stored in native UTC, so this is
-    a comparable datetime. For each missing worker found, call mark_worker_offline()
-    synchronously for cleanup.
+    The workers take turns to check at most once per WORKER_WATCHER_INTERVAL, and the check is
+    skipped by the others in the meantime.
+
+    To find a missing Worker process, look for Workers without a heartbeat within WORKER_TTL. For
+    each missing worker found, call mark_worker_offline() synchronously for cleanup. The
+    heartbeats are then saved to the Workers.
 
     This method also checks that at least one resource_manager and one worker process is
     present. If there are zero of either, log at the error level that Pulp will not operate
     correctly.
+
+    The purge of old tasks is dispatched when it is due.
     """
+    redis_conn = connection.get_redis_connection()
+    if not redis_conn.set(TASKING_CONSTANTS.WORKER_WATCHER_KEY, 1, nx=True,
+                          ex=TASKING_CONSTANTS.WORKER_WATCHER_INTERVAL):
+        return
+
     msg = _('Checking if pulp_workers or pulp_resource_manager processes are '
             'missing for more than %d seconds') % TASKING_CONSTANTS.WORKER_TTL
     _logger.debug(msg)
@@ -75,11 +89,15 @@ def check_worker_processes():
 
         mark_worker_offline(worker.name)
 
-    worker_count = Worker.objects.online_workers().filter(
-        name__startswith=TASKING_CONSTANTS.WORKER_PREFIX).count()
+    Worker.objects.save_heartbeats(Worker.objects.heartbeats())
 
-    resource_manager_count = Worker.objects.online_workers().filter(
-        name__startswith=TASKING_CONSTANTS.RESOURCE_MANAGER_WORKER_NAME).count()
+    online_workers = Worker.objects.online_workers().values_list('name', flat=True)
+    worker_count = resource_manager_count = 0
+    for name in online_workers:
+        if name.startswith(TASKING_CONSTANTS.WORKER_PREFIX):
+            worker_count += 1
+        elif name.startswith(TASKING_CONSTANTS.RESOURCE_MANAGER_WORKER_NAME):
+            resource_manager_count += 1
 
     if resource_manager_count == 0:
         msg = _("There are 0 pulp_resource_manager processes running. Pulp will not operate "
@@ -96,6 +114,26 @@ def check_worker_processes():
             "pulp_resource_manager processes") % output_dict
     _logger.debug(msg)
 
+    dispatch_task_purge()
+
+
+def dispatch_task_purge():
+    """
+    Dispatch the purge of the tasks older than TASKING['TASK_RETENTION_DAYS'].
+
+    The purge is dispatched with a low priority, at most once per TASK_PURGE_INTERVAL by all the
+    workers, and never when no retention is configured.
+    """
+    days = settings.TASKING['TASK_RETENTION_DAYS']
+    if not days:
+        return
+    redis_conn = connection.get_redis_connection()
+    if not redis_conn.set(TASKING_CONSTANTS.TASK_PURGE_KEY, 1, nx=True,
+                          ex=TASKING_CONSTANTS.TASK_PURGE_INTERVAL):
+        return
+    _logger.info(_('Purging the tasks finished more than %d days ago') % days)
+    enqueue_with_reservation(purge_tasks, [], args=(days, ), priority=TASK_PRIORITIES.LOW)
+
 
 def handle_worker_offline(worker_name):
     """
@@ -136,6 +174,8 @@ def mark_worker_offline(worker_name, normal_shutdown=False):
         msg = _("Cleaning up shutdown worker '%s'.") % worker_name
         _logger.info(msg)
 
+    Worker.objects.forget_heartbeat(worker_name)
+
     try:
         worker = Worker.objects.get(name=worker_name, gracefully_stopped=False, cleaned_up=False)
     except Worker.DoesNotExist:
@@ -1,15 +1,20 @@
 import logging
-import time
+import pickle
 import uuid
+from collections import OrderedDict
 from gettext import gettext as _
+from itertools import chain
 
-from django.db import IntegrityError
+from django.db import connection as db_connection, transaction
 from rq import Queue
 from rq.job import Job
 
 from pulpcore.app.models import Task, ReservedResource, Worker
-from pulpcore.common import TASK_STATES
+from pulpcore.common import (TASK_FINAL_STATES, TASK_PRIORITIES, TASK_PRIORITY_ORDER,
+                             TASK_STATES)
 from pulpcore.tasking import connection, util
+from pulpcore.tasking.constants import TASKING_CONSTANTS
+from pulpcore.tasking.queues import queue_name
 
 
 _logger = logging.getLogger(__name__)
@@ -33,12 +38,11 @@ def _acquire_worker(resources):
 
     Raises:
         Worker.DoesNotExist: If no worker is found
+        Worker.MultipleObjectsReturned: If several workers have some of the reservations
     """
     # Find a worker who already has this reservation, it is safe to send this work to them
     try:
         worker = Worker.objects.with_reservations(resources)
-    except Worker.MultipleObjectsReturned:
-        raise Worker.DoesNotExist
     except Worker.DoesNotExist:
         pass
     else:
@@ -48,7 +52,249 @@ def _acquire_worker(resources):
     return Worker.objects.get_unreserved_worker()
 
 
-def _queue_reserved_task(func, inner_task_id, resources, inner_args, inner_kwargs, options):
+def _lock_reservations():
+    """
+    Lock the reservations table until the end of the transaction.
+
+    Reservations can be neither created nor released while the lock is held, and only one
+    transaction holds it at a time.
+    """
+    with db_connection.cursor() as cursor:
+        cursor.execute('LOCK TABLE {table} IN SHARE ROW EXCLUSIVE MODE'.format(
+            table=ReservedResource._meta.db_table))
+
+
+def _line_key(resource):
+    """
+    Get the Redis key of the line of tasks waiting for a resource.
+
+    Args:
+        resource (str): The url of the resource.
+
+    Returns:
+        str: The key of the sorted set of the tasks waiting for the resource.
+    """
+    return TASKING_CONSTANTS.RESOURCE_LINE_KEY.format(resource=resource)
+
+
+def _position(priority):
+    """
+    Get the position of a task starting to wait, behind the waiting tasks of its priority.
+
+    Args:
+        priority (str): The priority of the task, one of TASK_PRIORITIES.
+
+    Returns:
+        int: The score of the task in the sorted sets of waiting tasks.
+    """
+    sequence = connection.get_redis_connection().incr(
+        TASKING_CONSTANTS.RESOURCE_LINE_SEQUENCE_KEY)
+    return TASK_PRIORITY_ORDER.index(priority) * 2 ** 40 + sequence
+
+
+def _line_up(task_id, resources, priority):
+    """
+    Put a task in the line of each of its resources, unless it is already in it.
+
+    Tasks are lined up by priority, then in the order they started to wait, and keep their place
+    when they wait again.
+
+    Args:
+        task_id (str): The id of the task.
+        resources (list): The urls of the resources of the task.
+        priority (str): The priority of the task, one of TASK_PRIORITIES.
+    """
+    if not resources:
+        return
+    position = _position(priority)
+    pipe = connection.get_redis_connection().pipeline()
+    for resource in resources:
+        pipe.execute_command('ZADD', _line_key(resource), 'NX', position, task_id)
+    pipe.execute()
+
+
+def _first_in_line(task_id, resources):
+    """
+    Whether a task is first in the line of each of its resources.
+
+    Args:
+        task_id (str): The id of the task.
+        resources (list): The urls of the resources of the task.
+
+    Returns:
+        bool: True when no task waiting for any of the resources is ahead of the task.
+    """
+    pipe = connection.get_redis_connection().pipeline()
+    for resource in resources:
+        pipe.zrange(_line_key(resource), 0, 0)
+    return all(first == [task_id.encode()] for first in pipe.execute())
+
+
+def _leave_line(task_id, resources):
+    """
+    Stop a task waiting, and wake the tasks then first in the line of its resources.
+
+    Args:
+        task_id (str): The id of the task.
+        resources (list): The urls of the resources of the task.
+    """
+    pipe = connection.get_redis_connection().pipeline()
+    for resource in resources:
+        pipe.zrem(_line_key(resource), task_id)
+    pipe.zrem(TASKING_CONSTANTS.WAITING_NO_RESERVATION_KEY, task_id)
+    pipe.zrem(TASKING_CONSTANTS.WAITING_WORKER_KEY, task_id)
+    waited_for_worker = pipe.execute()[-1]
+    _wake(resources)
+    if waited_for_worker:
+        _pass_on_worker()
+
+
+def _wait(dispatch, key=None):
+    """
+    Make a task wait until it is woken.
+
+    A waiting task is woken when it is first in the line of its resources and one of them is
+    released, or leaves the line.
+
+    Args:
+        dispatch (tuple): The arguments of :func:`_queue_reserved_task` for the task.
+        key (str): The Redis key of the tasks waiting for a worker, or for all the reservations
+            to be released, when the task waits for it too. The task keeps its place in it when
+            it waits again.
+    """
+    task_id = dispatch[1]
+    position = _position(dispatch[6]) if key else None
+    pipe = connection.get_redis_connection().pipeline()
+    pipe.set(TASKING_CONSTANTS.WAITING_TASK_KEY.format(task_id=task_id), pickle.dumps(dispatch))
+    if key:
+        pipe.execute_command('ZADD', key, 'NX', position, task_id)
+    if key == TASKING_CONSTANTS.WAITING_WORKER_KEY:
+        pipe.execute()
+    else:
+        pipe.zrem(TASKING_CONSTANTS.WAITING_WORKER_KEY, task_id)
+        if pipe.execute()[-1]:
+            # woken for a worker, the task now waits for something else
+            _pass_on_worker()
+    _logger.debug(_('Task {task_id} is waiting for reservations').format(task_id=task_id))
+
+
+def _wait_in_line(dispatch):
+    """
+    Make a task wait behind the tasks ahead of it in the line of its resources.
+
+    The tasks ahead may leave the line before the task waits, without waking it, so whether the
+    task is first in line is checked again once it waits.
+
+    Args:
+        dispatch (tuple): The arguments of :func:`_queue_reserved_task` for the task.
+    """
+    _wait(dispatch)
+    if _first_in_line(dispatch[1], dispatch[2]):
+        _wake(dispatch[2])
+
+
+def _wait_for_release(dispatch, resources):
+    """
+    Make a task wait for a reservation to be released, unless it is no longer blocked.
+
+    A release happening before the task waits does not wake it, so whether a worker can be
+    acquired is checked again once the task waits.
+
+    Args:
+        dispatch (tuple): The arguments of :func:`_queue_reserved_task` for the task.
+        resources (list): The urls of the reserved resources the task waits for. The task waits
+            for a worker without reservations when empty.
+    """
+    _wait(dispatch, None if resources else TASKING_CONSTANTS.WAITING_WORKER_KEY)
+    try:
+        _acquire_worker(dispatch[2])
+    except (Worker.DoesNotExist, Worker.MultipleObjectsReturned):
+        return
+    # a reservation was released, or a worker came online, before the task waited
+    _wake(resources, free_workers=0 if resources else 1)
+
+
+def _claim(task_id):
+    """
+    Stop a task waiting, unless it was woken already.
+
+    Args:
+        task_id (bytes): The id of the task.
+
+    Returns:
+        tuple: The arguments of :func:`_queue_reserved_task` for the task, or None when it is not
+            waiting.
+    """
+    key = TASKING_CONSTANTS.WAITING_TASK_KEY.format(task_id=task_id.decode())
+    dispatch, deleted = connection.get_redis_connection().pipeline().get(key).delete(
+        key).execute()
+    if deleted:
+        return pickle.loads(dispatch)
+
+
+def _pass_on_worker():
+    """
+    Wake the first task waiting for a worker, when a task stops waiting for one without taking
+    the worker it was woken for.
+    """
+    try:
+        Worker.objects.get_unreserved_worker()
+    except Worker.DoesNotExist:
+        return
+    _wake([], free_workers=1)
+
+
+def _wake(resources, free_workers=0):
+    """
+    Dispatch again the waiting tasks first in the line of resources.
+
+    For each worker freed, the first task waiting for a worker is woken too, and the tasks
+    waiting for all the reservations to be released are woken once there are none. Woken tasks
+    are queued in front of the resource manager queue of their priority, in the order they
+    started to wait, so a freed resource goes to the waiting task with the highest priority.
+    Each waiting task is claimed atomically, so it is woken once when several resource managers
+    wake it concurrently.
+
+    Args:
+        resources (list): The urls of the resources.
+        free_workers (int): The number of workers freed of all their reservations.
+    """
+    redis_conn = connection.get_redis_connection()
+    pipe = redis_conn.pipeline()
+    for resource in resources:
+        pipe.zrange(_line_key(resource), 0, 0)
+    first = OrderedDict.fromkeys(chain.from_iterable(pipe.execute()))
+    dispatches = [dispatch for dispatch in map(_claim, first) if dispatch]
+
+    if free_workers:
+        woken = 0
+        for task_id in redis_conn.zrange(TASKING_CONSTANTS.WAITING_WORKER_KEY, 0, -1):
+            if woken == free_workers:
+                break
+            dispatch = _claim(task_id)
+            if dispatch:
+                dispatches.append(dispatch)
+                woken += 1
+        if not ReservedResource.objects.exists():
+            waiting = redis_conn.zrange(TASKING_CONSTANTS.WAITING_NO_RESERVATION_KEY, 0, -1)
+            dispatches.extend(dispatch for dispatch in map(_claim, waiting) if dispatch)
+
+    for dispatch in reversed(dispatches):
+        q = Queue(queue_name('resource_manager', dispatch[6]), connection=redis_conn)
+        q.enqueue(_queue_reserved_task, args=dispatch, timeout=TASK_TIMEOUT, at_front=True)
+
+
+def wake_waiting_tasks():
+    """
+    Dispatch again the first task waiting for a worker.
+
+    Called when a worker becomes available.
+    """
+    _wake([], free_workers=1)
+
+
+def _queue_reserved_task(func, inner_task_id, resources, inner_args, inner_kwargs, options,
+                         priority=TASK_PRIORITIES.DEFAULT):
     """
     A task that encapsulates another task to be dispatched later.
 
@@ -61,6 +307,19 @@ def _queue_reserved_task(func, inner_task_id, resources, inner_args, inner_kwarg
     time. The logic deciding which queue receives a task is controlled through the
     find_worker function.
 
+    When no worker can reserve the resources, the task waits in Redis without blocking the
+    resource manager, and is dispatched again when a reservation it waits for is released.
+    Reservations are acquired atomically, so any number of resource managers can dispatch
+    concurrently.
+
+    The task is dispatched once it is first in the line of each of its resources, which it joined
+    when it was enqueued, so tasks get resources in the order they are enqueued whichever resource
+    manager dispatches them. A waiting task stays in those lines until it is dispatched, and the
+    tasks behind it in any of them wait for it, so they don't get its resources first.
+
+    The inner task is queued in the worker queue of its priority, which the worker drains before
+    the queues of lower priorities.
+
     Args:
         func (basestring): The function to be called
         inner_task_id (basestring): The UUID to be set on the task being called. By providing
@@ -72,51 +331,67 @@ def _queue_reserved_task(func, inner_task_id, resources, inner_args, inner_kwarg
         inner_args (tuple): The positional arguments to pass on to the task.
         inner_kwargs (dict): The keyword arguments to pass on to the task.
         options (dict): For all options accepted by enqueue see the RQ docs
+        priority (str): The priority of the task, one of TASK_PRIORITIES.
     """
     redis_conn = connection.get_redis_connection()
     task_status = Task.objects.get(pk=inner_task_id)
+    if task_status.state in TASK_FINAL_STATES:
+        # canceled while waiting
+        _leave_line(inner_task_id, resources)
+        return
     task_name = func.__module__ + '.' + func.__name__
-    while True:
-        if task_name == "pulpcore.app.tasks.orphan.orphan_cleanup":
+    dispatch = (func, inner_task_id, resources, inner_args, inner_kwargs, options, priority)
+
+    if task_name == "pulpcore.app.tasks.orphan.orphan_cleanup":
+        with transaction.atomic():
+            # no reservation can be created while the cleanup runs
+            _lock_reservations()
             if ReservedResource.objects.exists():
-                # wait until there are no reservations
-                time.sleep(0.25)
-                continue
-            else:
-                task_status.state = TASK_STATES.RUNNING
-                task_status.save()
-                q = Queue('resource_manager', connection=redis_conn, async=False)
-                q.enqueue(func, args=inner_args, kwargs=inner_kwargs, job_id=inner_task_id,
-                          timeout=TASK_TIMEOUT, **options)
-                task_status.state = TASK_STATES.COMPLETED
-                task_status.save()
+                # wait until there are no reservations, which can't be released until we wait
+                _wait(dispatch, TASKING_CONSTANTS.WAITING_NO_RESERVATION_KEY)
                 return
+            task_status.state = TASK_STATES.RUNNING
+            task_status.save()
+            q = Queue('resource_manager', connection=redis_conn, async=False)
+            q.enqueue(func, args=inner_args, kwargs=inner_kwargs, job_id=inner_task_id,
+                      timeout=TASK_TIMEOUT, **options)
+            task_status.state = TASK_STATES.COMPLETED
+            task_status.save()
+        _leave_line(inner_task_id, resources)
+        return
+
+    # keeps the place taken when the task was enqueued
+    _line_up(inner_task_id, resources, priority)
+    if not _first_in_line(inner_task_id, resources):
+        # a task waiting for some of the resources gets them first
+        _wait_in_line(dispatch)
+        return
 
-        try:
-            worker = _acquire_worker(resources)
-        except Worker.DoesNotExist:
-            # no worker is ready so we need to wait
-            time.sleep(0.25)
-            continue
-
-        try:
-            worker.lock_resources(task_status, resources)
-        except IntegrityError:
-            # we have a worker but we can't create the reservations so wait
-            time.sleep(0.25)
-        else:
-            # we have a worker with the locks
-            break
+    try:
+        worker = _acquire_worker(resources)
+    except Worker.MultipleObjectsReturned:
+        # several workers reserved some of the resources so wait for them
+        _wait_for_release(dispatch, resources)
+        return
+    except Worker.DoesNotExist:
+        # no worker is ready so we need to wait
+        _wait_for_release(dispatch, [])
+        return
+    if not worker.lock_resources(task_status, resources):
+        # another worker reserved some of the resources meanwhile so wait for them
+        _wait_for_release(dispatch, resources)
+        return
 
     task_status.worker = worker
     task_status.save()
 
     try:
-        q = Queue(worker.name, connection=redis_conn)
+        q = Queue(queue_name(worker.name, priority), connection=redis_conn)
         q.enqueue(func, args=inner_args, kwargs=inner_kwargs, job_id=inner_task_id,
                   timeout=TASK_TIMEOUT, **options)
     finally:
         q.enqueue(_release_resources, args=(inner_task_id, ))
+        _leave_line(inner_task_id, resources)
 
 
 def _release_resources(task_id):
@@ -124,7 +399,9 @@ def _release_resources(task_id):
     Do not queue this task yourself. It will be used automatically when your task is dispatched by
     the _queue_reserved_task task.
 
-    When a resource-reserving task is complete, this method releases the task's resource(s)
+    When a resource-reserving task is complete, this method releases the task's resource(s), and
+    dispatches again the tasks waiting for them, and for its worker when it has no reservations
+    left.
 
     Args:
         task_id (basestring): The UUID of the task that requested the reservation
@@ -141,10 +418,15 @@ def _release_resources(task_id):
         exc = RuntimeError(msg.format(task_id=task_id))
         task.set_failed(exc, None)
 
-    Task.objects.get(pk=task_id).release_resources()
+    task = Task.objects.get(pk=task_id)
+    resources = list(task.reserved_resources.values_list('resource', flat=True))
+    task.release_resources()
+    freed = not ReservedResource.objects.filter(worker_id=task.worker_id).exists()
+    _wake(resources, free_workers=1 if freed else 0)
 
 
-def enqueue_with_reservation(func, resources, args=None, kwargs=None, options=None):
+def enqueue_with_reservation(func, resources, args=None, kwargs=None, options=None,
+                             priority=TASK_PRIORITIES.DEFAULT):
     """
     Enqueue a message to Pulp workers with a reservation.
 
@@ -160,6 +442,12 @@ def enqueue_with_reservation(func, resources, args=None, kwargs=None, options=No
     task just after calling this method, so a Task entry needs to exist for it
     before it returns.
 
+    Tasks reserving the same resource get it in the order they are enqueued, even when several
+    resource managers dispatch them. Tasks of a higher priority are dispatched, and performed by
+    the workers, before the tasks of a lower priority which are queued. A task of a higher
+    priority waiting for a resource gets it first when it is released, so tasks reserving the
+    same resource may run out of order when their priorities differ.
+
     Args:
         func (callable): The function to be run by RQ when the necessary locks are acquired.
         resources (list): A list of resources to reserve guaranteeing that only one task
@@ -167,8 +455,12 @@ def enqueue_with_reservation(func, resources, args=None, kwargs=None, options=No
         args (tuple): The positional arguments to pass on to the task.
         kwargs (dict): The keyword arguments to pass on to the task.
         options (dict): The options to be passed on to the task.
+        priority (str): The priority of the task, one of TASK_PRIORITIES.
 
     Returns (rq.job.job): An RQ Job instance as returned by RQ's enqueue function
+
+    Raises:
+        ValueError: When the priority is unknown.
     """
     if not args:
         args = tuple()
@@ -176,12 +468,15 @@ def enqueue_with_reservation(func, resources, args=None, kwargs=None, options=No
         kwargs = dict()
     if not options:
         options = dict()
+    if priority not in TASK_PRIORITY_ORDER:
+        raise ValueError(_('Unknown task priority {priority}').format(priority=priority))
 
     resources = {util.get_url(resource) for resource in resources}
     inner_task_id = str(uuid.uuid4())
     Task.objects.create(pk=inner_task_id, state=TASK_STATES.WAITING)
+    _line_up(inner_task_id, resources, priority)
     redis_conn = connection.get_redis_connection()
-    q = Queue('resource_manager', connection=redis_conn)
-    task_args = (func, inner_task_id, list(resources), args, kwargs, options)
+    q = Queue(queue_name('resource_manager', priority), connection=redis_conn)
+    task_args = (func, inner_task_id, list(resources), args, kwargs, options, priority)
     q.enqueue(_queue_reserved_task, args=task_args, timeout=TASK_TIMEOUT)
     return Job(id=inner_task_id, connection=redis_conn)
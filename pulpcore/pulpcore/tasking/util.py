@@ -1,17 +1,20 @@
 from gettext import gettext as _
 import logging
-import time
 
 from django.db import transaction
 from django.urls import reverse
+from django.utils import timezone
+from rq import Queue
 from rq.job import Job
 
 from pulpcore.app.models import Task
+from pulpcore.app.models.progress import end_progress
 from pulpcore.app.serializers import view_name_for_model
-from pulpcore.common import TASK_FINAL_STATES, TASK_STATES
+from pulpcore.common import TASK_INCOMPLETE_STATES, TASK_PRIORITIES, TASK_STATES
 from pulpcore.exceptions import MissingResource
 from pulpcore.tasking import connection
 from pulpcore.tasking.constants import TASKING_CONSTANTS
+from pulpcore.tasking.queues import queue_name
 
 
 _logger = logging.getLogger(__name__)
@@ -24,38 +27,55 @@ def cancel(task_id):
     This method cancels only the task with given task_id, not the spawned tasks. This also updates
     task's state to 'canceled'.
 
+    A running task is killed by its worker, which then deletes the incomplete resources created by
+    the task. They are deleted right away when the task is not running, or its worker is offline.
+
     :param task_id: The ID of the task you wish to cancel
     :type  task_id: basestring
 
     :raises MissingResource: if a task with given task_id does not exist
     """
     try:
-        task_status = Task.objects.get(pk=task_id)
+        task_status = Task.objects.select_related('worker').get(pk=task_id)
     except Task.DoesNotExist:
         raise MissingResource(task_id)
 
-    if task_status.state in TASK_FINAL_STATES:
+    canceled = Task.objects.filter(pk=task_id, state__in=TASK_INCOMPLETE_STATES).update(
+        state=TASK_STATES.CANCELED, finished_at=timezone.now())
+    if not canceled:
         # If the task is already done, just stop
+        task_status.refresh_from_db()
         msg = _('Task [{task_id}] already in a completed state: {state}')
         _logger.info(msg.format(task_id=task_id, state=task_status.state))
         return
+    task_status.state = TASK_STATES.CANCELED
+    end_progress(task_id)
 
     redis_conn = connection.get_redis_connection()
     job = Job(id=str(task_id), connection=redis_conn)
 
-    if job.is_started:
-        redis_conn.sadd(TASKING_CONSTANTS.KILL_KEY, job.get_id())
+    if job.is_started and task_status.worker and task_status.worker.online:
+        key = TASKING_CONSTANTS.KILL_KEY.format(job_id=job.get_id())
+        # the key outlives the job when it ends before being killed
+        redis_conn.pipeline().rpush(key, 'kill').expire(key, TASKING_CONSTANTS.WORKER_TTL).execute()
+        # the worker runs the next job once the work horse is dead
+        q = Queue(queue_name(task_status.worker.name, TASK_PRIORITIES.HIGH), connection=redis_conn)
+        q.enqueue(_delete_canceled_task_resources, args=(task_id, ), at_front=True)
+    else:
+        _delete_incomplete_resources(task_status)
     job.delete()
 
-    # A hack to ensure that we aren't deleting resources still being used by the workhorse
-    time.sleep(1.5)
+    _logger.info(_('Task canceled: {id}.').format(id=task_id))
 
-    with transaction.atomic():
-        task_status.state = TASK_STATES.CANCELED
-        task_status.save()
-        _delete_incomplete_resources(task_status)
 
-    _logger.info(_('Task canceled: {id}.').format(id=task_id))
+def _delete_canceled_task_resources(task_id):
+    """
+    Delete all incomplete created-resources on a canceled task, once it is killed.
+
+    Args:
+        task_id (basestring): The ID of the canceled task.
+    """
+    _delete_incomplete_resources(Task.objects.get(pk=task_id))
 
 
 def _delete_incomplete_resources(task):
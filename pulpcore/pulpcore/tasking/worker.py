@@ -4,19 +4,23 @@ import signal
 import socket
 import sys
 import threading
-import time
 
 from rq import Queue
-from rq.worker import Worker
+from rq.worker import Worker, WorkerStatus
 
 
 import django  # noqa otherwise E402: module level not at top of file
 django.setup()  # noqa otherwise E402: module level not at top of file
 
 
+from django.conf import settings
+
 from pulpcore.app.models import Task
+from pulpcore.app.models.progress import end_progress, save_unsaved_done
 
 from pulpcore.tasking.constants import TASKING_CONSTANTS
+from pulpcore.tasking.queues import queue_names
+from pulpcore.tasking.services.errors import flush_non_fatal_errors
 from pulpcore.tasking.services.storage import WorkerDirectory
 from pulpcore.tasking.services.worker_watcher import (
     check_worker_processes,
@@ -27,6 +31,79 @@ from pulpcore.tasking.services.worker_watcher import (
 
 _logger = logging.getLogger(__name__)
 
+# Pushed on the kill key of a job to stop watching it.
+_STOP_WATCHING = b'stop'
+
+
+# Sent to the worker to cancel a job performed without forking.
+_CANCEL_SIGNAL = signal.SIGUSR1
+
+
+class JobCanceledException(Exception):
+    """
+    Raised in a job performed without forking when it is canceled.
+    """
+    pass
+
+
+def _watch_kill(conn, key, signum):
+    """
+    Signal the current process when a job is canceled.
+
+    Blocks until a message is pushed on the kill key of the job.
+
+    Args:
+        conn (redis.Redis): The Redis connection.
+        key (str): The kill key of the job.
+        signum (int): The signal sent to the current process.
+    """
+    _, message = conn.blpop(key)
+    if message != _STOP_WATCHING:
+        os.kill(os.getpid(), signum)
+
+
+def _heartbeat_until(worker, stopped):
+    """
+    Send the heartbeats of a worker performing a job without forking, until the job ends.
+
+    The heartbeats are sent every job monitoring interval, as the worker does while it monitors a
+    forked job.
+
+    Args:
+        worker (PulpWorker): The worker performing the job.
+        stopped (threading.Event): Set when the job ends.
+    """
+    try:
+        while not stopped.wait(worker.job_monitoring_interval):
+            worker.heartbeat(worker.job_monitoring_interval + 5)
+    finally:
+        django.db.connection.close()
+
+
+def _cancel_job(signum, frame):
+    """
+    Handle the signal canceling a job performed without forking.
+
+    Raises:
+        JobCanceledException: always.
+    """
+    raise JobCanceledException()
+
+
+def _reset_connections():
+    """
+    Close the database connections which can't be used by the next job.
+
+    Connections are kept open between jobs performed without forking, unless they are broken, or
+    were left in a transaction by the job.
+    """
+    for conn in django.db.connections.all():
+        if conn.connection is None:
+            continue
+        if conn.in_atomic_block or not conn.get_autocommit() or \
+                (conn.errors_occurred and not conn.is_usable()):
+            conn.close()
+
 
 class PulpWorker(Worker):
     """
@@ -36,12 +113,15 @@ class PulpWorker(Worker):
 
         * Replaces the string '%h' in the worker name with the fqdn
         * If the name starts with 'reserved_resource_worker' the worker ignores any other Queue
-          configuration and only subscribes to a queue of the same name as the worker name
+          configuration and only subscribes to the queues named after the worker name
         * If the name starts with 'resource_manager' the worker ignores any other Queue
-          configuration and only subscribes to the 'resource_manager' queue
+          configuration and only subscribes to the 'resource_manager' queues
+        * Drains the queues in priority order, one queue per task priority
         * Sets the worker TTL
         * Supports the killing of a job that is already running
         * Closes the database connection before forking so it is not process shared
+        * Performs jobs without forking, reusing database connections, when the
+          TASKING['FORK_JOBS'] setting is False
     """
 
     # Do not print "Result is kept for XXX seconds" after each job
@@ -52,29 +132,60 @@ class PulpWorker(Worker):
         kwargs['name'] = kwargs['name'].replace('%h', socket.getfqdn())
 
         if kwargs['name'].startswith(TASKING_CONSTANTS.WORKER_PREFIX):
-            queues = [Queue(kwargs['name'], connection=kwargs['connection'])]
+            queues = [Queue(name, connection=kwargs['connection'])
+                      for name in queue_names(kwargs['name'])]
         if kwargs['name'].startswith(TASKING_CONSTANTS.RESOURCE_MANAGER_WORKER_NAME):
-            queues = [Queue('resource_manager', connection=kwargs['connection'])]
+            queues = [Queue(name, connection=kwargs['connection'])
+                      for name in queue_names('resource_manager')]
 
         kwargs['default_worker_ttl'] = TASKING_CONSTANTS.WORKER_TTL
         kwargs['job_monitoring_interval'] = TASKING_CONSTANTS.JOB_MONITORING_INTERVAL
 
         return super().__init__(queues, **kwargs)
 
-    def execute_job(self, *args, **kwargs):
+    def execute_job(self, job, queue):
         """
         Close the database connection before forking, so that it is not shared
+
+        When the TASKING['FORK_JOBS'] setting is False, the job is performed by the worker itself,
+        which saves forking and connecting to the database for each job. Canceling the job then
+        raises a :class:`JobCanceledException` in it, instead of killing the process. The
+        heartbeats are sent by a Thread while the job runs.
+
+        Args:
+            job (rq.job.Job): The job to execute
+            queue (rq.queue.Queue): The Queue associated with the job
         """
-        django.db.connections.close_all()
-        super().execute_job(*args, **kwargs)
+        if settings.TASKING['FORK_JOBS']:
+            django.db.connections.close_all()
+            return super().execute_job(job, queue)
+
+        self.set_state(WorkerStatus.BUSY)
+        previous_handler = signal.signal(_CANCEL_SIGNAL, _cancel_job)
+        stopped = threading.Event()
+        heartbeat = threading.Thread(target=_heartbeat_until, args=(self, stopped), daemon=True)
+        heartbeat.start()
+        try:
+            self.perform_job(job, queue)
+        except JobCanceledException:
+            # canceled after the job ended
+            pass
+        finally:
+            stopped.set()
+            heartbeat.join()
+            signal.signal(_CANCEL_SIGNAL, previous_handler)
+            _reset_connections()
+        self.set_state(WorkerStatus.IDLE)
 
     def perform_job(self, job, queue):
         """
         Set the :class:`pulpcore.app.models.Task` to running and install a kill monitor Thread
 
         This method is called by the worker's work horse thread (the forked child) just before the
-        task begins executing. It creates a Thread which monitors a special Redis key which if
-        created should kill the task with SIGKILL.
+        task begins executing. It creates a Thread which blocks on a special Redis key of the job,
+        and kills the task with SIGKILL when the job is canceled. The Thread is stopped when the
+        job ends. When the job is performed without forking, the task is interrupted with a
+        :class:`JobCanceledException` instead.
 
         Args:
             job (rq.job.Job): The job to perform
@@ -87,35 +198,40 @@ class PulpWorker(Worker):
         else:
             task.set_running()
 
-        def check_kill(conn, id, interval=1):
-            while True:
-                res = conn.srem(TASKING_CONSTANTS.KILL_KEY, id)
-                if res > 0:
-                    os.kill(os.getpid(), signal.SIGKILL)
-                time.sleep(interval)
-
-        t = threading.Thread(target=check_kill, args=(self.connection, job.get_id()))
-        t.start()
-
-        return super().perform_job(job, queue)
+        key = TASKING_CONSTANTS.KILL_KEY.format(job_id=job.get_id())
+        signum = signal.SIGKILL if self._is_horse else _CANCEL_SIGNAL
+        watcher = threading.Thread(target=_watch_kill, args=(self.connection, key, signum),
+                                   daemon=True)
+        watcher.start()
+        try:
+            return super().perform_job(job, queue)
+        finally:
+            self.connection.rpush(key, _STOP_WATCHING)
+            watcher.join()
+            self.connection.delete(key)
 
     def handle_job_failure(self, job, **kwargs):
         """
         Set the :class:`pulpcore.app.models.Task` to failed and record the exception.
 
-        This method is called by rq to handle a job failure.
+        This method is called by rq to handle a job failure. The non-fatal errors still buffered
+        by the job, and the progress not saved yet, are recorded first.
 
         Args:
             job (rq.job.Job): The job that experienced the failure
             kwargs (dict): Unused parameters
         """
+        flush_non_fatal_errors(job.get_id())
+        save_unsaved_done()
         try:
             task = Task.objects.get(pk=job.get_id())
         except Task.DoesNotExist:
             pass
         else:
             exc_type, exc, tb = sys.exc_info()
-            task.set_failed(exc, tb)
+            if exc_type is not JobCanceledException:
+                task.set_failed(exc, tb)
+            end_progress(task.pk)
 
         return super().handle_job_failure(job, **kwargs)
 
@@ -123,19 +239,23 @@ class PulpWorker(Worker):
         """
         Set the :class:`pulpcore.app.models.Task` to completed.
 
-        This method is called by rq to handle a job success.
+        This method is called by rq to handle a job success. The non-fatal errors still buffered
+        by the job, and the progress not saved yet, are recorded first.
 
         Args:
             job (rq.job.Job): The job that experienced the success
             queue (rq.queue.Queue): The Queue associated with the job
             started_job_registry (rq.registry.StartedJobRegistry): The RQ registry of started jobs
         """
+        flush_non_fatal_errors(job.get_id())
+        save_unsaved_done()
         try:
             task = Task.objects.get(pk=job.get_id())
         except Task.DoesNotExist:
             pass
         else:
             task.set_completed()
+            end_progress(task.pk)
 
         return super().handle_job_success(job, queue, started_job_registry)
 
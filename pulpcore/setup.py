@@ -4,6 +4,7 @@ with open('README.rst') as f:
     long_description = f.read()
 
 requirements = [
+    'aiohttp',
     'coreapi',
     'Django>=1.11',
     'django-filter',
@@ -0,0 +1,166 @@
+import asyncio
+import hashlib
+import os
+import shutil
+import tempfile
+from unittest import mock
+
+from aiohttp import ClientPayloadError, web
+from aiohttp.test_utils import TestClient, TestServer
+from django.test import override_settings, TransactionTestCase
+
+from pulpcore.app.models import (Artifact, Content, ContentArtifact, Distribution, Publication,
+                                 PublishedArtifact, Publisher, Remote, RemoteArtifact, Repository,
+                                 RepositoryVersion)
+from pulpcore.content.handler import Handler
+
+
+DATA = b'0123456789' * 1000
+
+
+class FakeDownloader:
+    """
+    Reads DATA in chunks like the plugin downloaders do.
+    """
+
+    def __init__(self, url, custom_file_object, expected_digests, expected_size):
+        self.writer = custom_file_object
+        self.expected_digests = expected_digests
+        self.digests = {n: hashlib.new(n) for n in Artifact.DIGEST_FIELDS}
+
+    async def run(self):
+        for i in range(0, len(DATA), 1000):
+            chunk = DATA[i:i + 1000]
+            self.writer.write(chunk)
+            for digest in self.digests.values():
+                digest.update(chunk)
+            await asyncio.sleep(0.01)
+        self.writer.flush()
+        self.writer.close()
+        if self.expected_digests['sha256'] != self.digests['sha256'].hexdigest():
+            raise ValueError('digest mismatch')
+
+    @property
+    def artifact_attributes(self):
+        attributes = {n: d.hexdigest() for n, d in self.digests.items()}
+        attributes['size'] = len(DATA)
+        return attributes
+
+
+class HandlerRemoteArtifactTestCase(TransactionTestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        self.settings = override_settings(MEDIA_ROOT=self.root,
+                                          SERVER={'WORKING_DIRECTORY': self.root})
+        self.settings.enable()
+        self.addCleanup(self.settings.disable)
+
+        repository = Repository.objects.create(name='deferred')
+        version = RepositoryVersion.objects.create(repository=repository, number=1, complete=True)
+        publisher = Publisher.objects.create(name='deferred', type='publisher')
+        publication = Publication.objects.create(repository_version=version, publisher=publisher)
+        Distribution.objects.create(name='deferred', base_path='deferred',
+                                    publication=publication)
+        self.content_artifact = ContentArtifact.objects.create(
+            content=Content.objects.create(), relative_path='a.txt')
+        PublishedArtifact.objects.create(publication=publication, relative_path='a.txt',
+                                         content_artifact=self.content_artifact)
+        remote = Remote.objects.create(name='deferred', url='http://example.com/', type='remote')
+        RemoteArtifact.objects.create(url='http://example.com/a.txt', size=len(DATA),
+                                      sha256=hashlib.sha256(DATA).hexdigest(),
+                                      content_artifact=self.content_artifact, remote=remote)
+
+    def _get(self, method='GET', count=1):
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+        asyncio.set_event_loop(loop)
+        app = web.Application()
+        app.router.add_get('/{path:.+}', Handler().stream_content)
+
+        async def get(client):
+            response = await client.request(method, '/deferred/a.txt')
+            try:
+                return response.status, await response.read()
+            except ClientPayloadError:
+                return response.status, None
+
+        async def get_all():
+            async with TestClient(TestServer(app), loop=loop) as client:
+                return await asyncio.gather(*[get(client) for _ in range(count)])
+
+        with mock.patch.object(Remote, 'get_downloader', create=True,
+                               side_effect=FakeDownloader) as get_downloader:
+            responses = loop.run_until_complete(get_all())
+        self.downloads = get_downloader.call_count
+        return responses[0] if count == 1 else responses
+
+    def test_stream_and_store(self):
+        status, body = self._get()
+        self.assertEqual(status, 200)
+        self.assertEqual(body, DATA)
+        self.content_artifact.refresh_from_db()
+        with open(self.content_artifact.artifact.file.name, 'rb') as file:
+            self.assertEqual(file.read(), DATA)
+        self.assertEqual(os.listdir(self.root), ['artifact'])
+
+    def test_coalesced(self):
+        for status, body in self._get(count=5):
+            self.assertEqual(status, 200)
+            self.assertEqual(body, DATA)
+        self.assertEqual(self.downloads, 1)
+        self.content_artifact.refresh_from_db()
+        self.assertIsNotNone(self.content_artifact.artifact)
+
+    def test_digest_mismatch(self):
+        RemoteArtifact.objects.update(sha256='0' * 64)
+        status, body = self._get()
+        self.assertEqual(status, 200)
+        self.assertIsNone(body)
+        self.content_artifact.refresh_from_db()
+        self.assertIsNone(self.content_artifact.artifact)
+        self.assertEqual(os.listdir(self.root), [])
+
+    def test_head(self):
+        status, body = self._get('HEAD')
+        self.assertEqual(status, 200)
+        self.assertEqual(body, b'')
+        self.content_artifact.refresh_from_db()
+        self.assertIsNone(self.content_artifact.artifact)
+
+    def test_cancelled(self):
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+        asyncio.set_event_loop(loop)
+        errors = []
+        loop.set_exception_handler(lambda loop, context: errors.append(context))
+        handler = Handler()
+        remote_artifact = RemoteArtifact.objects.get()
+        with mock.patch.object(Remote, 'get_downloader', create=True,
+                               side_effect=FakeDownloader):
+            fetch = handler._fetch(remote_artifact, remote_artifact.remote)
+            fetch.task.cancel()
+            with self.assertRaises(web.HTTPBadGateway):
+                loop.run_until_complete(handler._stream_fetch(None, None, fetch))
+        self.assertEqual(handler._fetches, {})
+        self.assertEqual(errors, [])
+
+    def test_remote_replaced(self):
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+        asyncio.set_event_loop(loop)
+        closed = []
+
+        class Factory:
+            async def close(self):
+                closed.append(self)
+
+        handler = Handler()
+        old, new = Remote.objects.get(), Remote.objects.get()
+        old._download_factory = Factory()
+        self.assertIs(handler._cache_remote(old), old)
+        self.assertIs(handler._cache_remote(Remote.objects.get()), old)
+        new.save()
+        self.assertIs(handler._cache_remote(new), new)
+        loop.run_until_complete(asyncio.gather(*asyncio.Task.all_tasks(loop)))
+        self.assertEqual(closed, [old._download_factory])
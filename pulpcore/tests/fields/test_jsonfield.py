@@ -1,9 +1,12 @@
 import json
 from unittest.mock import patch
 
+from django.db import connection
 from django.test import TestCase
 
+from pulpcore.app import viewsets
 from pulpcore.app.fields import JSONField
+from pulpcore.app.models import Task
 
 
 class TestJSONField(TestCase):
@@ -18,9 +21,9 @@ class TestJSONField(TestCase):
         self.assertDictEqual(self.obj, new_obj)
 
     def test_from_db_value(self):
-        """Assert the value returned by from_db_value is the same as the initial value"""
-        new_obj = self.json_field.from_db_value(self.obj_json)
-        self.assertDictEqual(self.obj, new_obj)
+        """Assert from_db_value returns the value decoded by psycopg2 unchanged"""
+        self.assertIs(self.json_field.from_db_value(self.obj), self.obj)
+        self.assertEqual(self.json_field.from_db_value(self.obj_json), self.obj_json)
 
     def test_get_db_prep_value(self):
         """Assert the value returned by get_db_prep_value matches a serialized version of obj"""
@@ -32,3 +35,28 @@ class TestJSONField(TestCase):
         with patch('pulpcore.app.fields.JSONField.value_from_object', return_value=self.obj):
             new_obj = self.json_field.value_to_string(object())
             self.assertEquals(self.obj_json, new_obj)
+
+
+class TestJSONFieldStorage(TestCase):
+    def test_jsonb(self):
+        """Assert values are stored as jsonb and loaded back"""
+        error = {'description': 'boom', 'traceback': ['a', 'b'], 'code': None}
+        task = Task.objects.create(state='failed', error=error)
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT jsonb_typeof(error) FROM {table} WHERE id = %s'.format(
+                table=Task._meta.db_table), [task.pk])
+            self.assertEqual(cursor.fetchone(), ('object', ))
+        self.assertEqual(Task.objects.get(pk=task.pk).error, error)
+
+    def test_scalars(self):
+        """Assert JSON scalars, strings included, are loaded back"""
+        for error in ('boom', '{"a": 1}', 12, [1, 'a']):
+            task = Task.objects.create(state='failed', error=error)
+            self.assertEqual(Task.objects.get(pk=task.pk).error, error)
+
+    def test_deferred(self):
+        """Assert tasks are listed without loading their errors"""
+        Task.objects.create(state='failed', error={'description': 'boom'})
+        viewset = viewsets.TaskViewSet(action='list', kwargs={})
+        task = viewset.get_queryset().get()
+        self.assertEqual(task.get_deferred_fields(), {'error'})
@@ -0,0 +1,66 @@
+import threading
+import time
+from unittest import mock
+
+from django.test import TestCase
+
+from pulpcore.app.models import ProgressBar, Task
+from pulpcore.app.models.progress import (_publish, end_progress, save_unsaved_done,
+                                          wait_for_progress)
+
+
+class ProgressBarTestCase(TestCase):
+    def setUp(self):
+        self.task = Task.objects.create(state='running')
+        self.addCleanup(end_progress, self.task.pk)
+        patcher = mock.patch('pulpcore.app.models.task.get_current_job',
+                             return_value=mock.Mock(id=self.task.pk))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.bar = ProgressBar(message='progress', total=10)
+        self.bar.save()
+
+    def _done(self):
+        return ProgressBar.objects.get(pk=self.bar.pk).done
+
+    def test_increment_coalesced(self):
+        with self.assertNumQueries(0):
+            for _ in range(5):
+                self.bar.increment()
+        self.assertEqual(self._done(), 0)
+        with self.assertNumQueries(1):
+            save_unsaved_done()
+        self.assertEqual(self._done(), 5)
+        with self.assertNumQueries(0):
+            save_unsaved_done()
+
+    def test_increment_published(self):
+        for _ in range(10):
+            self.bar.increment()
+        # the done count is published right away when all the items are done
+        bar = ProgressBar.objects.get(pk=self.bar.pk)
+        self.assertEqual(bar.done, 0)
+        bar.load_published_done()
+        self.assertEqual(bar.done, 10)
+
+    def test_wait_for_progress(self):
+        version = wait_for_progress(self.task.pk, None, 0)
+        start = time.monotonic()
+        self.assertEqual(wait_for_progress(self.task.pk, version, 0.1), version)
+        self.assertGreaterEqual(time.monotonic() - start, 0.1)
+
+        timer = threading.Timer(0.1, _publish, args=(self.task.pk, {str(self.bar.pk): 1}))
+        timer.start()
+        self.addCleanup(timer.join)
+        self.assertEqual(wait_for_progress(self.task.pk, version, 10), version + 1)
+
+        end_progress(self.task.pk)
+        Task.objects.filter(pk=self.task.pk).update(state='completed')
+        self.assertEqual(wait_for_progress(self.task.pk, 0, 10), 0)
+
+    def test_context_manager(self):
+        with ProgressBar(message='context', total=3) as bar:
+            for _ in bar.iter(range(2)):
+                pass
+        bar = ProgressBar.objects.get(pk=bar.pk)
+        self.assertEqual((bar.done, bar.state), (2, 'completed'))
@@ -0,0 +1,229 @@
+import time
+import uuid
+from contextlib import suppress
+from unittest import mock
+
+from django.core.exceptions import ObjectDoesNotExist
+from django.test import TestCase, TransactionTestCase
+from redis.exceptions import RedisError
+
+from pulpcore.app.models import (Content, ContentArtifact, Distribution, ProgressBar, Publication,
+                                 PublishedArtifact, PublishedMetadata, Publisher, Repository,
+                                 RepositoryVersion, Task)
+
+
+class DistributionMatchTestCase(TransactionTestCase):
+    def setUp(self):
+        Distribution.objects.create(name='foo', base_path='foo/bar')
+        Distribution.objects.create(name='baz', base_path='baz')
+
+    def test_match(self):
+        self.assertEqual(Distribution.objects.match('foo/bar/file.txt').name, 'foo')
+        self.assertEqual(Distribution.objects.match('/foo/bar/a/b/file.txt').name, 'foo')
+        self.assertEqual(Distribution.objects.match('baz/file.txt').name, 'baz')
+
+    def test_no_match(self):
+        for path in ('foo/file.txt', 'foo/bar', 'bazz/file.txt', 'file.txt'):
+            with self.assertRaises(Distribution.DoesNotExist):
+                Distribution.objects.match(path)
+
+    def test_overlapping(self):
+        foo = Distribution.objects.get(name='foo')
+        for path in ('foo', 'foo/bar', 'foo/bar/baz'):
+            self.assertEqual(Distribution.objects.overlapping(path).name, 'foo')
+            self.assertIsNone(Distribution.objects.overlapping(path, exclude=foo.pk))
+        for path in ('fo', 'foo/baz', 'bazz', 'qux/baz'):
+            self.assertIsNone(Distribution.objects.overlapping(path))
+
+    def test_invalidated_on_change(self):
+        self.assertEqual(Distribution.objects.match('baz/file.txt').name, 'baz')
+        distribution = Distribution.objects.get(name='baz')
+        distribution.base_path = 'fizz'
+        distribution.save()
+        with self.assertRaises(Distribution.DoesNotExist):
+            Distribution.objects.match('baz/file.txt')
+        self.assertEqual(Distribution.objects.match('fizz/file.txt').name, 'baz')
+        Distribution.objects.filter(name='baz').update(base_path='buzz')
+        self.assertEqual(Distribution.objects.match('buzz/file.txt').name, 'baz')
+        Distribution.objects.filter(name='baz').delete()
+        with self.assertRaises(Distribution.DoesNotExist):
+            Distribution.objects.match('buzz/file.txt')
+
+    def test_subscribed(self):
+        Distribution.objects.subscribe()
+        self.addCleanup(setattr, Distribution.objects, '_published', None)
+        for _ in range(100):
+            if Distribution.objects._published is not None:
+                break
+            time.sleep(0.01)
+        self.assertEqual(Distribution.objects.match('baz/file.txt').name, 'baz')
+        Distribution.objects.filter(name='baz').update(base_path='fizz')
+        Distribution.objects.invalidate_routes()
+        for _ in range(100):
+            with suppress(Distribution.DoesNotExist):
+                if Distribution.objects.match('fizz/file.txt'):
+                    break
+            time.sleep(0.01)
+        self.assertEqual(Distribution.objects.match('fizz/file.txt').name, 'baz')
+
+    def test_distributed_on_publication(self):
+        repository = Repository.objects.create(name='distributed')
+        version = RepositoryVersion.objects.create(repository=repository, number=1, complete=True)
+        publisher = Publisher.objects.create(name='distributed', type='publisher')
+        Distribution.objects.filter(name='foo').update(publisher=publisher, repository=repository)
+        Distribution.objects.create(name='qux', base_path='qux', publisher=publisher,
+                                    repository=repository)
+        self.assertIsNone(Distribution.objects.match('qux/file.txt').publication_id)
+        publication = Publication.objects.create(repository_version=version, publisher=publisher)
+        with publication:
+            pass
+        distributed = Distribution.objects.filter(publication=publication)
+        self.assertEqual(set(distributed.values_list('name', flat=True)), {'foo', 'qux'})
+        self.assertEqual(Distribution.objects.match('qux/file.txt').publication_id, publication.pk)
+        self.assertIsNone(Distribution.objects.match('baz/file.txt').publication_id)
+
+    def test_invalidated_on_version_deleted(self):
+        repository = Repository.objects.create(name='deleted')
+        version = RepositoryVersion.objects.create(repository=repository, number=1, complete=True)
+        publisher = Publisher.objects.create(name='deleted', type='publisher')
+        publication = Publication.objects.create(repository_version=version, publisher=publisher,
+                                                 complete=True)
+        Distribution.objects.filter(name='baz').update(publication=publication)
+        self.assertEqual(Distribution.objects.match('baz/file.txt').publication_id, publication.pk)
+        version.delete()
+        self.assertIsNone(Distribution.objects.match('baz/file.txt').publication_id)
+
+    def test_distributed_on_index_failure(self):
+        repository = Repository.objects.create(name='unindexed')
+        version = RepositoryVersion.objects.create(repository=repository, number=1, complete=True)
+        publisher = Publisher.objects.create(name='unindexed', type='publisher')
+        Distribution.objects.filter(name='foo').update(publisher=publisher, repository=repository)
+        self.assertIsNone(Distribution.objects.match('foo/bar/file.txt').publication_id)
+        publication = Publication.objects.create(repository_version=version, publisher=publisher)
+        with mock.patch.object(Publication, 'build_index', side_effect=RedisError):
+            with publication:
+                pass
+        self.assertEqual(Distribution.objects.match('foo/bar/file.txt').publication_id,
+                         publication.pk)
+
+
+class PublicationIndexTestCase(TransactionTestCase):
+    def setUp(self):
+        self.repository = Repository.objects.create(name='index')
+        self.version = RepositoryVersion.objects.create(repository=self.repository, number=1,
+                                                        complete=True)
+        publisher = Publisher.objects.create(name='index', type='publisher')
+        self.publication = Publication.objects.create(repository_version=self.version,
+                                                      publisher=publisher)
+        content_artifact = ContentArtifact.objects.create(content=Content.objects.create(),
+                                                          relative_path='a.txt')
+        PublishedArtifact.objects.create(publication=self.publication, relative_path='a.txt',
+                                         content_artifact=content_artifact)
+        PublishedMetadata.objects.create(publication=self.publication, relative_path='meta.xml',
+                                         file='published/meta.xml')
+
+    def test_resolve(self):
+        self.assertIsNone(Publication.objects.resolve(self.publication.pk, 'meta.xml'))
+        with self.publication:
+            pass
+        self.assertEqual(Publication.objects.resolve(self.publication.pk, 'meta.xml'),
+                         'published/meta.xml')
+        # the artifact is not stored
+        self.assertIsNone(Publication.objects.resolve(self.publication.pk, 'a.txt'))
+        with self.assertRaises(ObjectDoesNotExist):
+            Publication.objects.resolve(self.publication.pk, 'missing.txt')
+
+        self.publication.delete()
+        self.assertIsNone(Publication.objects.resolve(self.publication.pk, 'meta.xml'))
+
+    def test_index_artifact(self):
+        content_artifact = self.publication.published_artifact.get().content_artifact
+        # not indexed
+        Publication.objects.index_artifact(content_artifact.pk, 'artifact/a.txt')
+        self.assertIsNone(Publication.objects.resolve(self.publication.pk, 'a.txt'))
+        with self.publication:
+            pass
+        Publication.objects.index_artifact(content_artifact.pk, 'artifact/a.txt')
+        self.assertEqual(Publication.objects.resolve(self.publication.pk, 'a.txt'),
+                         'artifact/a.txt')
+        self.publication.delete()
+
+    def test_empty(self):
+        self.publication.published_artifact.all().delete()
+        self.publication.published_metadata.all().delete()
+        with self.publication:
+            pass
+        # the publication is indexed, without files
+        with self.assertRaises(ObjectDoesNotExist):
+            Publication.objects.resolve(self.publication.pk, 'meta.xml')
+
+    def test_version_deleted(self):
+        with self.publication:
+            pass
+        self.version.delete()
+        self.assertIsNone(Publication.objects.resolve(self.publication.pk, 'meta.xml'))
+
+    def test_versions_squashed(self):
+        with self.publication:
+            pass
+        version = RepositoryVersion.objects.create(repository=self.repository, number=2,
+                                                   complete=True)
+        self.assertEqual(version.squash_previous(), 1)
+        self.assertIsNone(Publication.objects.resolve(self.publication.pk, 'meta.xml'))
+
+
+class PublishArtifactsTestCase(TestCase):
+    def setUp(self):
+        self.repository = Repository.objects.create(name='publish')
+        self.content = {}
+        for name in ('a.txt', 'b.txt', 'c.txt', 'd.txt'):
+            self.content[name] = Content.objects.create()
+            ContentArtifact.objects.create(content=self.content[name], relative_path=name)
+        self.version = self._version(1, add=('a.txt', 'b.txt', 'c.txt'))
+        self.publisher = Publisher.objects.create(name='publish', type='publisher')
+        task = Task.objects.create(state='running')
+        patcher = mock.patch('pulpcore.app.models.task.get_current_job',
+                             return_value=mock.Mock(id=task.pk))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _version(self, number, add=(), remove=()):
+        version = RepositoryVersion.objects.create(repository=self.repository, number=number)
+        for name in add:
+            version.add_content(self.content[name])
+        for name in remove:
+            version.remove_content(self.content[name])
+        version.complete = True
+        version.save()
+        return version
+
+    def _published(self, publication):
+        return set(publication.published_artifact.values_list('relative_path', flat=True))
+
+    @mock.patch('pulpcore.app.models.publication.PUBLISHED_ARTIFACT_BATCH_SIZE', 2)
+    def test_publish_artifacts(self):
+        publication = Publication.objects.create(repository_version=self.version,
+                                                 publisher=self.publisher)
+        self.assertEqual(publication.publish_artifacts(lambda ca: 'x/' + ca.relative_path), 3)
+        self.assertEqual(self._published(publication), {'x/a.txt', 'x/b.txt', 'x/c.txt'})
+        progress = ProgressBar.objects.get()
+        self.assertEqual((progress.done, progress.total, progress.state), (3, 3, 'completed'))
+
+    def test_publish_artifacts_incremental(self):
+        with Publication.create(self.version, self.publisher) as publication:
+            self.assertIsNone(publication.previous())
+            self.assertEqual(publication.publish_artifacts(incremental=True), 3)
+        self._version(2, add=('d.txt',), remove=('b.txt', 'c.txt'))
+        version = self._version(3, add=('c.txt',))
+        with Publication.create(version, self.publisher) as incremental:
+            self.assertEqual(incremental.previous(), publication)
+            self.assertEqual(incremental.publish_artifacts(incremental=True), 3)
+        self.assertEqual(self._published(incremental), {'a.txt', 'c.txt', 'd.txt'})
+        self.assertEqual(self._published(publication), {'a.txt', 'b.txt', 'c.txt'})
+        # the copied published artifacts are counted in the progress
+        progress = ProgressBar.objects.order_by('created').last()
+        self.assertEqual((progress.done, progress.total), (3, 3))
+        # the copies get random (version 4) UUIDs
+        for published_artifact in incremental.published_artifact.all():
+            self.assertEqual((published_artifact.pk.version, published_artifact.pk.variant),
+                             (4, uuid.RFC_4122))
@@ -0,0 +1,76 @@
+from django.test import TestCase
+
+from pulpcore.app.models import Content, Repository, RepositoryVersion
+
+
+class RepositoryVersionSquashTestCase(TestCase):
+    def setUp(self):
+        self.repository = Repository.objects.create(name='squash')
+        self.content = [Content.objects.create() for _ in range(4)]
+        c1, c2, c3, c4 = self.content
+        # version 1: c1, c2
+        # version 2: c1, c3        (c2 removed)
+        # version 3: c1, c2, c3    (c2 re-added)
+        # version 4: c2, c3, c4    (c1 removed)
+        self._version([c1, c2], [])
+        self._version([c3], [c2])
+        self._version([c2], [])
+        self._version([c4], [c1])
+
+    def _version(self, add, remove):
+        number = self.repository.last_version + 1
+        version = RepositoryVersion.objects.create(repository=self.repository, number=number)
+        self.repository.last_version = number
+        self.repository.save()
+        for content in add:
+            version.add_content(content)
+        for content in remove:
+            version.remove_content(content)
+        version.complete = True
+        version.save()
+        return version
+
+    def _content_sets(self):
+        return {v.number: set(v.content) for v in self.repository.versions.all()}
+
+    def test_delete_squashes_into_next(self):
+        expected = self._content_sets()
+        for number in (2, 1):
+            RepositoryVersion.objects.get(repository=self.repository, number=number).delete()
+            del expected[number]
+            self.assertEqual(self._content_sets(), expected)
+
+    def test_squash_previous(self):
+        expected = self._content_sets()
+        version = RepositoryVersion.objects.get(repository=self.repository, number=3)
+        self.assertEqual(version.squash_previous(), 2)
+        self.assertEqual(self._content_sets(), {3: expected[3], 4: expected[4]})
+        self.assertEqual(set(version.added()), expected[3])
+        self.assertEqual(set(self.repository.versions.get(number=4).removed()), {self.content[0]})
+
+
+class RepositoryVersionReaddedTestCase(TestCase):
+    def setUp(self):
+        self.repository = Repository.objects.create(name='readded')
+        self.content = [Content.objects.create() for _ in range(3)]
+        c1, c2, c3 = self.content
+        # version 1: c1, c3
+        # version 2: c1, c2        (c3 removed)
+        # version 3: c1            (c2 removed)
+        # version 4: c1, c2, c3    (c2 and c3 re-added)
+        # version 5: c1, c2        (c3 removed)
+        self._version([c1, c3], [])
+        self._version([c2], [c3])
+        self._version([], [c2])
+        self._version([c2, c3], [])
+        self._version([], [c3])
+
+    _version = RepositoryVersionSquashTestCase._version
+    _content_sets = RepositoryVersionSquashTestCase._content_sets
+
+    def test_delete(self):
+        for number in (1, 3, 2):
+            expected = self._content_sets()
+            RepositoryVersion.objects.get(repository=self.repository, number=number).delete()
+            del expected[number]
+            self.assertEqual(self._content_sets(), expected)
@@ -1,7 +1,14 @@
+from datetime import timedelta
+
 from django.db.models import ProtectedError
-from django.test import TestCase
+from django.test import TestCase, override_settings
+from rq import Queue
+from rq.registry import StartedJobRegistry
+from rq.utils import utcnow
 
 from pulpcore.app.models import ReservedResource, Task, TaskReservedResource, Worker
+from pulpcore.tasking.connection import get_redis_connection
+from pulpcore.tasking.constants import TASKING_CONSTANTS
 
 
 class TaskTestCase(TestCase):
@@ -20,3 +27,79 @@ class TaskTestCase(TestCase):
         task.release_resources()
         task.delete()
         self.assertFalse(Task.objects.filter(id=task.id).exists())
+
+
+class ReservationTestCase(TestCase):
+    def setUp(self):
+        self.workers = [Worker.objects.create(name=TASKING_CONSTANTS.WORKER_PREFIX + str(i))
+                        for i in range(2)]
+        self.tasks = [Task.objects.create(state='waiting') for _ in range(3)]
+
+    def test_lock_resources(self):
+        first, second = self.workers
+        self.assertTrue(first.lock_resources(self.tasks[0], ['a', 'b']))
+        self.assertTrue(first.lock_resources(self.tasks[1], ['b']))
+        # reserved by another worker
+        self.assertFalse(second.lock_resources(self.tasks[2], ['c', 'a']))
+        self.assertFalse(ReservedResource.objects.filter(resource='c').exists())
+        self.assertFalse(self.tasks[2].reserved_resources.exists())
+
+        self.tasks[0].release_resources()
+        self.assertEqual(list(ReservedResource.objects.values_list('resource', flat=True)), ['b'])
+        self.assertTrue(second.lock_resources(self.tasks[2], ['c', 'a']))
+        self.tasks[1].release_resources()
+        self.assertEqual(set(ReservedResource.objects.values_list('resource', flat=True)),
+                         {'a', 'c'})
+
+
+class WorkerSelectionTestCase(TestCase):
+    def setUp(self):
+        self.workers = [Worker.objects.create(name=TASKING_CONSTANTS.WORKER_PREFIX + str(i))
+                        for i in range(2)]
+        for worker in self.workers:
+            Worker.objects.heartbeat(worker.name)
+            self.addCleanup(Worker.objects.forget_heartbeat, worker.name)
+        self.queue = Queue(self.workers[0].name, connection=get_redis_connection())
+        self.addCleanup(self.queue.delete)
+        self.queue.enqueue(print)
+
+    def test_least_loaded(self):
+        self.assertEqual(self.workers[0].load(), 1)
+        self.assertEqual(self.workers[1].load(), 0)
+        for _ in range(5):
+            self.assertEqual(Worker.objects.get_unreserved_worker(), self.workers[1])
+
+    def test_running(self):
+        job = self.queue.dequeue()
+        self.addCleanup(job.delete)
+        job.started_at = utcnow() - timedelta(seconds=TASKING_CONSTANTS.RUNNING_JOB_LOAD_INTERVAL)
+        job.save()
+        registry = StartedJobRegistry(self.queue.name, connection=get_redis_connection())
+        registry.add(job, 60)
+        self.addCleanup(registry.remove, job)
+        # a running job counts as one more job for each RUNNING_JOB_LOAD_INTERVAL it has run
+        self.assertAlmostEqual(self.workers[0].load(), 2, places=2)
+        loads = Worker.objects.loads(self.workers)
+        self.assertAlmostEqual(loads[self.workers[0].name], 2, places=2)
+        self.assertEqual(loads[self.workers[1].name], 0)
+
+    def test_capacity(self):
+        queue = Queue(self.workers[1].name, connection=get_redis_connection())
+        self.addCleanup(queue.delete)
+        queue.enqueue(print)
+        capacity = {'WORKER_CAPACITY': {TASKING_CONSTANTS.WORKER_PREFIX + '0': 2}}
+        with override_settings(TASKING=capacity):
+            self.assertEqual(self.workers[0].capacity, 2)
+            self.assertEqual(self.workers[1].capacity, 1)
+            self.assertEqual(Worker.objects.get_unreserved_worker(), self.workers[0])
+            # reserved workers are not selected
+            self.workers[0].lock_resources(Task.objects.create(), ['a'])
+            self.assertEqual(Worker.objects.get_unreserved_worker(), self.workers[1])
+
+    def test_no_capacity(self):
+        capacity = {'WORKER_CAPACITY': {TASKING_CONSTANTS.WORKER_PREFIX + '1': 0}}
+        with override_settings(TASKING=capacity):
+            self.assertEqual(Worker.objects.get_unreserved_worker(), self.workers[0])
+            self.workers[0].lock_resources(Task.objects.create(), ['a'])
+            with self.assertRaises(Worker.DoesNotExist):
+                Worker.objects.get_unreserved_worker()
@@ -0,0 +1,41 @@
+from unittest import mock
+
+from django.test import TestCase
+from rest_framework.test import APIRequestFactory
+
+from pulpcore.app.models import ProgressBar, Task
+from pulpcore.app.models.progress import end_progress
+from pulpcore.app.serializers import ProgressReportSerializer
+
+
+class ProgressReportSerializerTestCase(TestCase):
+    def setUp(self):
+        self.task = Task.objects.create(state='running')
+        self.addCleanup(end_progress, self.task.pk)
+        patcher = mock.patch('pulpcore.app.models.task.get_current_job',
+                             return_value=mock.Mock(id=self.task.pk))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.context = {'request': APIRequestFactory().get('/')}
+
+    def _done(self, bar):
+        bar = ProgressBar.objects.get(pk=bar.pk)
+        return ProgressReportSerializer(bar, context=self.context).data['done']
+
+    def test_published_done(self):
+        """Assert the published done count is shown for a bar used without the context manager"""
+        bar = ProgressBar(message='progress', total=10)
+        bar.save()
+        for _ in range(10):
+            bar.increment()
+        # the bar is still waiting, but its task runs
+        self.assertEqual(self._done(bar), 10)
+
+    def test_task_finished(self):
+        """Assert the saved done count is shown once the task is finished"""
+        bar = ProgressBar(message='progress', total=10, state='running')
+        bar.save()
+        for _ in range(10):
+            bar.increment()
+        Task.objects.filter(pk=self.task.pk).update(state='completed')
+        self.assertEqual(self._done(bar), 0)
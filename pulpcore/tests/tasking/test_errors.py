@@ -0,0 +1,35 @@
+from unittest import mock
+
+from django.test import TestCase
+
+from pulpcore.app.models import Task
+from pulpcore.tasking.services.errors import append_non_fatal_error, flush_non_fatal_errors
+
+
+@mock.patch.multiple('pulpcore.tasking.constants.TASKING_CONSTANTS',
+                     NON_FATAL_ERROR_BATCH_SIZE=3, NON_FATAL_ERROR_LIMIT=5)
+class NonFatalErrorTestCase(TestCase):
+    def setUp(self):
+        self.task = Task.objects.create(state='running')
+        self.addCleanup(flush_non_fatal_errors, self.task.pk)
+
+    def _recorded(self):
+        return [e.error['n'] for e in self.task.non_fatal_errors.all()]
+
+    def test_batched(self):
+        append_non_fatal_error(self.task.pk, {'n': 0})
+        append_non_fatal_error(self.task.pk, {'n': 1})
+        self.assertEqual(self._recorded(), [])
+        append_non_fatal_error(self.task.pk, {'n': 2})
+        self.assertEqual(self._recorded(), [0, 1, 2])
+        append_non_fatal_error(self.task.pk, {'n': 3})
+        flush_non_fatal_errors(self.task.pk)
+        self.assertEqual(self._recorded(), [0, 1, 2, 3])
+
+    def test_overflow(self):
+        for n in range(8):
+            append_non_fatal_error(self.task.pk, {'n': n})
+        flush_non_fatal_errors(self.task.pk)
+        self.assertEqual(self._recorded(), [0, 1, 2, 3, 4])
+        self.task.refresh_from_db()
+        self.assertEqual(self.task.non_fatal_errors_overflow, 3)
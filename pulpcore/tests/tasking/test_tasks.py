@@ -0,0 +1,161 @@
+from unittest import mock
+
+from django.test import TestCase
+
+from pulpcore.app.models import Task, Worker
+from pulpcore.common import TASK_PRIORITIES
+from pulpcore.tasking import connection
+from pulpcore.tasking.constants import TASKING_CONSTANTS
+from pulpcore.tasking.services.worker_watcher import handle_worker_heartbeat
+from pulpcore.tasking.tasks import (TASK_TIMEOUT, _queue_reserved_task, _release_resources,
+                                    enqueue_with_reservation)
+
+
+def inner():
+    pass
+
+
+class QueueReservedTaskTestCase(TestCase):
+    def setUp(self):
+        self.redis_conn = connection.get_redis_connection()
+        self.addCleanup(self._clear)
+        self._clear()
+        patcher = mock.patch('pulpcore.tasking.tasks.Queue')
+        self.queue = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _heartbeat(self, host='host'):
+        name = TASKING_CONSTANTS.WORKER_PREFIX + '@' + host
+        self.addCleanup(Worker.objects.forget_heartbeat, name)
+        handle_worker_heartbeat(name)
+        return Worker.objects.get(name=name)
+
+    def _clear(self):
+        keys = self.redis_conn.keys('pulp:tasking:waiting:*') + \
+            self.redis_conn.keys('pulp:tasking:line:*')
+        if keys:
+            self.redis_conn.delete(*keys)
+
+    def _dispatch(self, resources, priority=TASK_PRIORITIES.DEFAULT):
+        task = Task.objects.create(state='waiting')
+        args = (inner, str(task.pk), resources, (), {}, {}, priority)
+        _queue_reserved_task(*args)
+        return args
+
+    def test_wait_for_worker(self):
+        first = self._dispatch(['a'])
+        second = self._dispatch(['b'])
+        self.queue.return_value.enqueue.assert_not_called()
+        self.assertEqual(self.redis_conn.zrange(TASKING_CONSTANTS.WAITING_WORKER_KEY, 0, -1),
+                         [first[1].encode(), second[1].encode()])
+
+        # a worker coming online wakes one task
+        worker = self._heartbeat()
+        enqueue = self.queue.return_value.enqueue
+        self.assertEqual(enqueue.call_args_list, [mock.call(
+            _queue_reserved_task, args=first, timeout=TASK_TIMEOUT, at_front=True)])
+
+        # woken tasks are dispatched to the worker
+        enqueue.reset_mock()
+        _queue_reserved_task(*first)
+        task = Task.objects.get(pk=first[1])
+        self.assertEqual(task.worker, worker)
+        self.assertEqual(task.reserved_resources.get().resource, 'a')
+        self.assertEqual(self.redis_conn.zrange(TASKING_CONSTANTS.WAITING_WORKER_KEY, 0, -1),
+                         [second[1].encode()])
+
+    def test_wait_for_release(self):
+        worker = self._heartbeat()
+        busy = Task.objects.create(state='running')
+        worker.lock_resources(busy, ['a'])
+        args = self._dispatch(['b'])
+        self.queue.return_value.enqueue.assert_not_called()
+
+        _release_resources(str(busy.pk))
+        self.assertEqual(self.queue.return_value.enqueue.call_args[1]['args'], args)
+        self.assertFalse(self.redis_conn.exists(
+            TASKING_CONSTANTS.WAITING_TASK_KEY.format(task_id=args[1])))
+
+    def test_wait_for_free_worker(self):
+        worker = self._heartbeat()
+        busy = [Task.objects.create(state='running', worker=worker) for i in range(2)]
+        for task in busy:
+            worker.lock_resources(task, ['a'])
+        first = self._dispatch(['b'])
+        self._dispatch(['c'])
+        enqueue = self.queue.return_value.enqueue
+
+        # the worker still reserves 'a' for the other task
+        _release_resources(str(busy[0].pk))
+        enqueue.assert_not_called()
+
+        # the worker is free, for one task
+        _release_resources(str(busy[1].pk))
+        self.assertEqual([c[1]['args'] for c in enqueue.call_args_list], [first])
+
+    def test_wait_in_line(self):
+        workers = [self._heartbeat('host1'), self._heartbeat('host2')]
+        busy = [Task.objects.create(state='running') for worker in workers]
+        workers[0].lock_resources(busy[0], ['s'])
+        workers[1].lock_resources(busy[1], ['r'])
+        first = self._dispatch(['r', 's'])
+        # the second task waits for the first one, though the worker reserving 'r' could take it
+        second = self._dispatch(['r'])
+        enqueue = self.queue.return_value.enqueue
+        enqueue.assert_not_called()
+
+        _release_resources(str(busy[0].pk))
+        self.assertEqual([c[1]['args'] for c in enqueue.call_args_list], [first])
+
+        # the second task is woken once the first one is dispatched
+        enqueue.reset_mock()
+        _queue_reserved_task(*first)
+        self.assertEqual(Task.objects.get(pk=first[1]).worker, workers[1])
+        self.assertEqual(enqueue.call_args[1]['args'], second)
+        self.assertEqual(self.redis_conn.zrange(TASKING_CONSTANTS.RESOURCE_LINE_KEY.format(
+            resource='r'), 0, -1), [second[1].encode()])
+
+    @mock.patch('pulpcore.tasking.util.get_url', lambda resource: resource)
+    def test_dispatch_in_order(self):
+        self._heartbeat()
+        enqueue = self.queue.return_value.enqueue
+        enqueue_with_reservation(inner, ['r'])
+        enqueue_with_reservation(inner, ['r'])
+        first, second = [c[1]['args'] for c in enqueue.call_args_list]
+
+        # another resource manager dispatches the second task first
+        enqueue.reset_mock()
+        _queue_reserved_task(*second)
+        enqueue.assert_not_called()
+
+        _queue_reserved_task(*first)
+        self.assertEqual(enqueue.call_args[1]['args'], second)
+
+    def test_canceled_while_waiting(self):
+        args = self._dispatch(['a'])
+        Task.objects.filter(pk=args[1]).update(state='canceled')
+        self._heartbeat()
+        self.queue.return_value.enqueue.reset_mock()
+        _queue_reserved_task(*args)
+        self.queue.return_value.enqueue.assert_not_called()
+        self.assertFalse(Task.objects.get(pk=args[1]).reserved_resources.exists())
+        self.assertEqual(self.redis_conn.keys('pulp:tasking:line:*'), [])
+
+    def test_wake_by_priority(self):
+        self._dispatch(['a'], TASK_PRIORITIES.LOW)
+        high = self._dispatch(['b'], TASK_PRIORITIES.HIGH)
+        self.queue.reset_mock()
+
+        worker = self._heartbeat()
+        queues = [c[0][0] for c in self.queue.call_args_list]
+        self.assertEqual(queues, ['resource_manager:high'])
+
+        # the task is queued for the worker in the queue of its priority
+        self.queue.reset_mock()
+        _queue_reserved_task(*high)
+        self.queue.assert_called_once_with(worker.name + ':high', connection=self.redis_conn)
+
+    def test_unknown_priority(self):
+        with self.assertRaises(ValueError):
+            enqueue_with_reservation(inner, [], priority='urgent')
+        self.queue.assert_not_called()
@@ -0,0 +1,56 @@
+from django.test import TestCase
+from rq import Queue
+from rq.job import Job, JobStatus
+
+from pulpcore.app.models import CreatedResource, Repository, RepositoryVersion, Task, Worker
+from pulpcore.common import TASK_PRIORITIES
+from pulpcore.tasking import connection
+from pulpcore.tasking.constants import TASKING_CONSTANTS
+from pulpcore.tasking.queues import queue_name
+from pulpcore.tasking.util import _delete_canceled_task_resources, cancel
+
+
+class CancelTestCase(TestCase):
+    def setUp(self):
+        self.redis_conn = connection.get_redis_connection()
+        self.worker = Worker.objects.create(name=TASKING_CONSTANTS.WORKER_PREFIX + '@host')
+        Worker.objects.heartbeat(self.worker.name)
+        self.addCleanup(Worker.objects.forget_heartbeat, self.worker.name)
+        self.task = Task.objects.create(state='running', worker=self.worker)
+        repository = Repository.objects.create(name='cancel')
+        self.version = RepositoryVersion.objects.create(repository=repository, number=1)
+        CreatedResource.objects.create(task=self.task, content_object=self.version)
+        self.job = Job.create(print, id=str(self.task.pk), connection=self.redis_conn)
+        self.job.save()
+        self.queue = Queue(queue_name(self.worker.name, TASK_PRIORITIES.HIGH),
+                           connection=self.redis_conn)
+        self.kill_key = TASKING_CONSTANTS.KILL_KEY.format(job_id=self.job.id)
+        self.addCleanup(self.queue.delete)
+        self.addCleanup(self.redis_conn.delete, self.kill_key)
+
+    def test_cancel_running(self):
+        self.job.set_status(JobStatus.STARTED)
+        cancel(self.task.pk)
+        self.assertEqual(Task.objects.get(pk=self.task.pk).state, 'canceled')
+        self.assertEqual(self.redis_conn.lrange(self.kill_key, 0, -1), [b'kill'])
+        # the resources are deleted by the worker, before its other jobs, after the job is killed
+        self.assertTrue(RepositoryVersion.objects.filter(pk=self.version.pk).exists())
+        cleanup = self.queue.jobs[0]
+        self.assertEqual((cleanup.func, cleanup.args),
+                         (_delete_canceled_task_resources, (self.task.pk, )))
+        cleanup.perform()
+        self.assertFalse(RepositoryVersion.objects.filter(pk=self.version.pk).exists())
+
+    def test_cancel_waiting(self):
+        Task.objects.filter(pk=self.task.pk).update(state='waiting')
+        cancel(self.task.pk)
+        self.assertEqual(Task.objects.get(pk=self.task.pk).state, 'canceled')
+        self.assertFalse(self.redis_conn.exists(self.kill_key))
+        self.assertTrue(self.queue.is_empty())
+        self.assertFalse(RepositoryVersion.objects.filter(pk=self.version.pk).exists())
+
+    def test_cancel_completed(self):
+        Task.objects.filter(pk=self.task.pk).update(state='completed')
+        cancel(self.task.pk)
+        self.assertEqual(Task.objects.get(pk=self.task.pk).state, 'completed')
+        self.assertTrue(RepositoryVersion.objects.filter(pk=self.version.pk).exists())
@@ -0,0 +1,67 @@
+import time
+from unittest import mock
+
+from django.test import TestCase, override_settings
+from rq import Queue
+
+from pulpcore.app.models import Task, Worker
+from pulpcore.tasking import connection
+from pulpcore.tasking.constants import TASKING_CONSTANTS
+from pulpcore.tasking.worker import PulpWorker
+
+
+def current_task():
+    return Task.current().pk
+
+
+def wait_for_kill():
+    job_id = str(Task.current().pk)
+    connection.get_redis_connection().rpush(TASKING_CONSTANTS.KILL_KEY.format(job_id=job_id),
+                                            'kill')
+    time.sleep(10)
+
+
+def outlive_worker_ttl():
+    time.sleep(TASKING_CONSTANTS.WORKER_TTL + 1)
+
+
+@override_settings(TASKING={'FORK_JOBS': False, 'WORKER_CAPACITY': {}, 'TASK_RETENTION_DAYS': None})
+@mock.patch('pulpcore.tasking.worker._reset_connections')
+class InProcessTestCase(TestCase):
+    def setUp(self):
+        redis_conn = connection.get_redis_connection()
+        self.worker = PulpWorker([], name=TASKING_CONSTANTS.WORKER_PREFIX + '@host',
+                                 connection=redis_conn)
+        Worker.objects.create(name=self.worker.name)
+        Worker.objects.heartbeat(self.worker.name)
+        self.addCleanup(Worker.objects.forget_heartbeat, self.worker.name)
+        self.queue = Queue(self.worker.name, connection=redis_conn)
+        self.addCleanup(self.queue.delete)
+
+    def _execute(self, func):
+        task = Task.objects.create(state='waiting', worker=Worker.objects.get())
+        job = self.queue.enqueue(func, job_id=str(task.pk))
+        self.queue.pop_job_id()
+        self.worker.execute_job(job, self.queue)
+        return Task.objects.get(pk=task.pk)
+
+    def test_completed(self, reset_connections):
+        task = self._execute(current_task)
+        self.assertEqual(task.state, 'completed')
+        reset_connections.assert_called_once_with()
+
+    def test_killed(self, reset_connections):
+        start = time.time()
+        task = self._execute(wait_for_kill)
+        self.assertLess(time.time() - start, 10)
+        # the worker survives and the task is not failed, it is canceled by the caller
+        self.assertEqual(task.state, 'running')
+        reset_connections.assert_called_once_with()
+
+    @mock.patch.object(TASKING_CONSTANTS, 'WORKER_TTL', 2)
+    def test_heartbeat(self, reset_connections):
+        self.worker.job_monitoring_interval = 1
+        task = self._execute(outlive_worker_ttl)
+        self.assertEqual(task.state, 'completed')
+        # the worker kept sending heartbeats while the job ran
+        self.assertTrue(Worker.objects.get().online)
@@ -0,0 +1,78 @@
+from datetime import timedelta
+from unittest import mock
+
+from django.conf import settings
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from pulpcore.app.models import Worker
+from pulpcore.app.tasks import purge_tasks
+from pulpcore.tasking import connection
+from pulpcore.tasking.constants import TASKING_CONSTANTS
+from pulpcore.tasking.services.worker_watcher import (check_worker_processes,
+                                                      dispatch_task_purge,
+                                                      handle_worker_heartbeat)
+
+
+class WorkerWatcherTestCase(TestCase):
+    def setUp(self):
+        self.redis_conn = connection.get_redis_connection()
+        self.names = [TASKING_CONSTANTS.WORKER_PREFIX + '_{}@host'.format(i) for i in range(2)]
+        for name in self.names:
+            self.addCleanup(Worker.objects.forget_heartbeat, name)
+        self.redis_conn.delete(TASKING_CONSTANTS.WORKER_WATCHER_KEY)
+        self.addCleanup(self.redis_conn.delete, TASKING_CONSTANTS.WORKER_WATCHER_KEY)
+
+    def test_heartbeat(self):
+        with mock.patch('pulpcore.tasking.services.worker_watcher.wake_waiting_tasks') as wake:
+            handle_worker_heartbeat(self.names[0])
+            worker = Worker.objects.get(name=self.names[0])
+            self.assertTrue(worker.online)
+            self.assertEqual(wake.call_count, 1)
+            # later heartbeats don't touch the database
+            with self.assertNumQueries(0):
+                handle_worker_heartbeat(self.names[0])
+            self.assertEqual(wake.call_count, 1)
+
+    def test_check_worker_processes(self):
+        for name in self.names:
+            handle_worker_heartbeat(name)
+        stale = timezone.now() - timedelta(seconds=TASKING_CONSTANTS.WORKER_TTL + 1)
+        self.redis_conn.execute_command('ZADD', TASKING_CONSTANTS.HEARTBEATS_KEY,
+                                        stale.timestamp(), self.names[1])
+        Worker.objects.filter(name=self.names[0]).update(last_heartbeat=stale)
+
+        check_worker_processes()
+        online, missing = (Worker.objects.get(name=name) for name in self.names)
+        self.assertTrue(online.online)
+        self.assertGreater(online.last_heartbeat, stale)
+        self.assertTrue(missing.cleaned_up)
+        self.assertFalse(missing.online)
+        self.assertNotIn(missing.name, Worker.objects.heartbeats())
+
+        # other workers skip the check for a while
+        handle_worker_heartbeat(self.names[1])
+        with self.assertNumQueries(0):
+            check_worker_processes()
+        self.assertFalse(Worker.objects.get(name=self.names[1]).cleaned_up)
+
+
+class TaskPurgeTestCase(TestCase):
+    def setUp(self):
+        redis_conn = connection.get_redis_connection()
+        redis_conn.delete(TASKING_CONSTANTS.TASK_PURGE_KEY)
+        self.addCleanup(redis_conn.delete, TASKING_CONSTANTS.TASK_PURGE_KEY)
+        patcher = mock.patch('pulpcore.tasking.services.worker_watcher.enqueue_with_reservation')
+        self.enqueue = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    @override_settings(TASKING=dict(settings.TASKING, TASK_RETENTION_DAYS=30))
+    def test_dispatch(self):
+        dispatch_task_purge()
+        dispatch_task_purge()
+        self.enqueue.assert_called_once_with(purge_tasks, [], args=(30, ), priority='low')
+
+    @override_settings(TASKING=dict(settings.TASKING, TASK_RETENTION_DAYS=None))
+    def test_no_retention(self):
+        dispatch_task_purge()
+        self.enqueue.assert_not_called()
@@ -0,0 +1,43 @@
+from unittest import mock
+
+from django.core.exceptions import ObjectDoesNotExist
+from django.test import TestCase
+
+from pulpcore.app.models import (Content, ContentArtifact, Publication, PublishedArtifact,
+                                 PublishedMetadata, Publisher, Repository, RepositoryVersion, Task)
+from pulpcore.app.models.publication import PUBLICATION_INDEX_KEY
+from pulpcore.app.tasks import orphan_cleanup
+from pulpcore.tasking.connection import get_redis_connection
+
+
+class OrphanCleanupTestCase(TestCase):
+    def setUp(self):
+        task = Task.objects.create(state='running')
+        patcher = mock.patch('pulpcore.app.models.task.get_current_job',
+                             return_value=mock.Mock(id=task.pk))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_published_content(self):
+        repository = Repository.objects.create(name='orphan')
+        version = RepositoryVersion.objects.create(repository=repository, number=1, complete=True)
+        publisher = Publisher.objects.create(name='orphan', type='publisher')
+        publication = Publication.objects.create(repository_version=version, publisher=publisher,
+                                                 complete=True)
+        content_artifact = ContentArtifact.objects.create(content=Content.objects.create(),
+                                                          relative_path='a.txt')
+        PublishedArtifact.objects.create(publication=publication, relative_path='a.txt',
+                                         content_artifact=content_artifact)
+        PublishedMetadata.objects.create(publication=publication, relative_path='meta.xml',
+                                         file='published/meta.xml')
+        publication.build_index()
+        self.addCleanup(get_redis_connection().delete,
+                        PUBLICATION_INDEX_KEY.format(pk=publication.pk))
+
+        orphan_cleanup()
+        self.assertFalse(ContentArtifact.objects.exists())
+        # the index no longer has the deleted published artifact
+        with self.assertRaises(ObjectDoesNotExist):
+            Publication.objects.resolve(publication.pk, 'a.txt')
+        self.assertEqual(Publication.objects.resolve(publication.pk, 'meta.xml'),
+                         'published/meta.xml')
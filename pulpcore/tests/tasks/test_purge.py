@@ -0,0 +1,48 @@
+from datetime import timedelta
+from unittest import mock
+
+from django.test import TestCase
+from django.utils import timezone
+
+from pulpcore.app.models import ProgressBar, Task, Worker
+from pulpcore.app.tasks import purge_tasks
+
+
+class PurgeTasksTestCase(TestCase):
+    def setUp(self):
+        self.task = Task.objects.create(state='running')
+        patcher = mock.patch('pulpcore.app.models.task.get_current_job',
+                             return_value=mock.Mock(id=self.task.pk))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _task(self, state, days_ago):
+        finished_at = timezone.now() - timedelta(days=days_ago)
+        return Task.objects.create(state=state, finished_at=finished_at)
+
+    @mock.patch('pulpcore.app.tasks.purge.TASK_PURGE_BATCH_SIZE', 2)
+    def test_purge(self):
+        old = [self._task(state, 10) for state in ('completed', 'failed', 'canceled')]
+        recent = self._task('completed', 1)
+        waiting = self._task('waiting', 10)
+        ProgressBar.objects.create(task=old[0], message='old', total=1)
+        Task.objects.filter(pk=recent.pk).update(parent=old[1])
+
+        purge_tasks(5)
+        self.assertEqual(set(Task.objects.values_list('pk', flat=True)),
+                         {self.task.pk, recent.pk, waiting.pk})
+        progress = ProgressBar.objects.get()
+        self.assertEqual((progress.task, progress.done, progress.total), (self.task, 3, 3))
+        self.assertIsNone(Task.objects.get(pk=recent.pk).parent)
+
+    def test_reserved(self):
+        reserved = self._task('completed', 10)
+        worker = Worker.objects.create(name='reserved_resource_worker@host')
+        worker.lock_resources(reserved, ['a'])
+        old = self._task('completed', 10)
+
+        purge_tasks(5)
+        self.assertEqual(set(Task.objects.values_list('pk', flat=True)),
+                         {self.task.pk, reserved.pk})
+        self.assertEqual(ProgressBar.objects.get().total, 1)
+        self.assertFalse(Task.objects.filter(pk=old.pk).exists())
@@ -0,0 +1,80 @@
+import os
+import tempfile
+from unittest import TestCase
+
+from django.test import RequestFactory
+from django.utils.http import http_date
+
+from pulpcore.app.views import ContentView
+
+
+class TestContentViewStream(TestCase):
+    def setUp(self):
+        with tempfile.NamedTemporaryFile(delete=False) as file:
+            file.write(b'0123456789')
+        self.path = file.name
+        self.addCleanup(os.remove, self.path)
+
+    def _stream(self, method='get', **headers):
+        view = ContentView()
+        view.request = getattr(RequestFactory(), method)('/', **headers)
+        return view._stream(self.path)
+
+    def test_whole_file(self):
+        response = self._stream()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), b'0123456789')
+        self.assertEqual(response.file_to_stream.name, self.path)
+        self.assertEqual(response['Content-Length'], '10')
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+
+    def test_head(self):
+        response = self._stream('head')
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.streaming)
+        self.assertEqual(response['Content-Length'], '10')
+
+    def test_range(self):
+        response = self._stream(HTTP_RANGE='bytes=2-4')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(b''.join(response.streaming_content), b'234')
+        self.assertEqual(response['Content-Range'], 'bytes 2-4/10')
+
+        response = self._stream(HTTP_RANGE='bytes=7-')
+        self.assertEqual(b''.join(response.streaming_content), b'789')
+
+        response = self._stream(HTTP_RANGE='bytes=-3')
+        self.assertEqual(b''.join(response.streaming_content), b'789')
+        self.assertEqual(response['Content-Range'], 'bytes 7-9/10')
+
+    def test_range_not_satisfiable(self):
+        response = self._stream(HTTP_RANGE='bytes=10-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], 'bytes */10')
+
+    def test_range_empty_file(self):
+        open(self.path, 'w').close()
+        for byte_range in ('bytes=0-', 'bytes=-3'):
+            response = self._stream(HTTP_RANGE=byte_range)
+            self.assertEqual(response.status_code, 416)
+            self.assertEqual(response['Content-Range'], 'bytes */0')
+
+    def test_if_range(self):
+        etag = self._stream()['ETag']
+        response = self._stream(HTTP_RANGE='bytes=2-4', HTTP_IF_RANGE=etag)
+        # a weak entity tag never matches If-Range
+        self.assertEqual(response.status_code, 200)
+
+        last_modified = http_date(os.stat(self.path).st_mtime)
+        response = self._stream(HTTP_RANGE='bytes=2-4', HTTP_IF_RANGE=last_modified)
+        self.assertEqual(response.status_code, 206)
+
+    def test_not_modified(self):
+        etag = self._stream()['ETag']
+        response = self._stream(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+
+        last_modified = http_date(os.stat(self.path).st_mtime)
+        response = self._stream(HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 304)
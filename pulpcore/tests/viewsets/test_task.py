@@ -0,0 +1,41 @@
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from pulpcore.app.models import Task
+from pulpcore.app.viewsets import TaskViewSet
+
+
+# the filters are covered elsewhere, only whether they are given matters here
+@mock.patch.object(TaskViewSet, 'filter_queryset', lambda self, qs: qs)
+@mock.patch('pulpcore.app.viewsets.task.cancel_task')
+class CancelListTestCase(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(get_user_model().objects.create(username='admin'))
+        self.tasks = [Task.objects.create(state='waiting') for i in range(2)]
+        self.url = reverse('tasks-cancel')
+
+    def test_unfiltered(self, cancel_task):
+        response = self.client.post(self.url, format='json')
+        self.assertEqual(response.status_code, 400)
+        cancel_task.assert_not_called()
+
+    def test_filtered(self, cancel_task):
+        response = self.client.post(self.url + '?state=waiting', format='json')
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual({c[0][0] for c in cancel_task.call_args_list},
+                         {task.pk for task in self.tasks})
+
+    def test_listed(self, cancel_task):
+        href = reverse('tasks-detail', args=[self.tasks[0].pk])
+        response = self.client.post(self.url, {'tasks': [href]}, format='json')
+        self.assertEqual(response.status_code, 204)
+        cancel_task.assert_called_once_with(self.tasks[0].pk)
+
+        response = self.client.post(self.url, {'tasks': ['/pulp/api/v3/workers/']},
+                                    format='json')
+        self.assertEqual(response.status_code, 400)